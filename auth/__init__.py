@@ -8,7 +8,6 @@
 #
 from wtforms import TextField, PasswordField
 from flask import Flask, render_template, session
-from flask_sessionstore import Session, SqlAlchemySessionInterface
 from flask_login import LoginManager
 from flask_gravatar import Gravatar
 from flask_ckeditor import CKEditor
@@ -16,7 +15,9 @@ from datetime import datetime
 import redis
 
 from .models import db, migrate, login_manager, User, Email, rdb, UserOnline
+from .models import mark_online
 from .utils import mail
+from .sessions import RedisSessions, SESSION_PREFIX
 
 from .api import api
 from .cli import cli
@@ -27,15 +28,17 @@ from .user import user_view
 from .admin import admin_view
 from .admin_forums import admin_forum_view
 from .forum import forum_view
+from .search import search_view
 from .warn import warnings
 from .log import log_view
 
-from .tasks import celery, reset_user_warnings
+from .tasks import celery
 
 def create_app(info=None):
 	app = Flask(__name__)
 	app.config.from_object('config')
-	Session(app)
+	app.session_interface = RedisSessions(rdb, SESSION_PREFIX,
+		permanent=app.config.get('SESSION_PERMANENT', True))
 	ckeditor = CKEditor(app)
 	gravatar = Gravatar(app,size=100,rating='pg',default='identicon',
 		force_default=False, force_lower=False, use_ssl=True, base_url=None)
@@ -47,27 +50,28 @@ def create_app(info=None):
 	app.register_blueprint(admin_view)
 	app.register_blueprint(admin_forum_view)
 	app.register_blueprint(forum_view)
+	app.register_blueprint(search_view)
 	app.register_blueprint(warnings)
 	app.register_blueprint(log_view)
 
 	db.init_app(app)
-	SqlAlchemySessionInterface(app, db, "sessions", "my_", permanent=False)
 	migrate.init_app(app, db)
 	login_manager.init_app(app)
 	mail.init_app(app)
 	cli.init_app(app)
 	celery.conf.update(app.config)
-	reset_user_warnings.apply_async(countdown=60)
 
 	@app.before_request
 	def set_online_status():
 		from flask import request
 		from flask_login import current_user
-		
+
+		#static files say nothing about presence, skip loading the user.
+		if request.endpoint and request.endpoint.endswith('static'):
+			return
+
 		if current_user.is_authenticated():
-			current_user.lastactive = datetime.utcnow()
-			rdb.setex(current_user.id, 600, current_user.display)
-			db.session.commit()
+			mark_online(current_user)
 
 	@app.shell_context_processor
 	def shell_context():
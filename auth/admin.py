@@ -15,16 +15,17 @@ import pendulum
 import json
 
 from .models import db, authz, Group, User, Email, UserPermission
+from .models import invalidate_permissions, publish_policy
 from .models import Log, GroupPermission, Thread, Post, Warning, Board
 from .forms import AdminUserForm, AdminUserListForm, AdminCreateUserForm 
 from .forms import UserGroupForm, UserPermForm, GroupListForm, GroupEditForm
-from .forms import GroupCreateForm, InfoForm
-from .utils import mail, parse_token, sign_token
+from .forms import GroupCreateForm, InfoForm, MassMailForm, MassPMForm
+from .utils import mail, parse_token, sign_token, check_password
 from .log import create_log
 from sqlalchemy import func
 from .services import YamlCompiler, ScssCompiler
-from .tasks import send_async_email, delete_user, recount_all_boards_posts
-from .tasks import recount_all_users_posts, reset_user_terms, reset_user_privacy
+from .tasks import send_mass_email, delete_user, recount_all_boards_posts
+from .tasks import recount_all_users_posts, send_mass_pm
 
 admin_view = Blueprint('admin', __name__)
 
@@ -47,15 +48,60 @@ def info():
 			recount_all_users_posts.delay()
 			flash('Topics and posts are scheduled for recount.', 'success')
 		if form.resetterms.data:
-			reset_user_terms.delay()
-			flash('User Term agreements scheduled for reset.', 'success')
+			publish_policy('terms')
+			db.session.commit()
+			flash('User Term agreements have been reset.', 'success')
 		if form.resetprivacy.data:
-			reset_user_privacy.delay()
-			flash('User Privacy agreements scheduled for reset.', 'success')
+			publish_policy('privacy')
+			db.session.commit()
+			flash('User Privacy agreements have been reset.', 'success')
 	
 	return render_template('admin/info.htm', form=form, users=users, posts=posts,
 		threads=threads, warnings=warnings, logs=logs, newest=newest)
 
+@admin_view.route('/admin/mass_mail', methods=('GET', 'POST'))
+@authz.requires(rights.permission(Group, 'admin:view'), methods=('GET', 'POST'))
+@authz.requires(rights.permission(Group, 'mail:mass'), methods=('GET', 'POST'))
+def mass_mail():
+	form = MassMailForm()
+	form.group.choices = [(0, 'Everyone')] + [(group.id, group.display)
+		for group in Group.query.order_by(Group.name)]
+
+	if form.validate_on_submit():
+		if check_password(form.password.data):
+			send_mass_email.delay(form.subject.data, form.body.data,
+				request.host_url, form.group.data or None)
+			create_log('Mass mail "{}" was sent'.format(form.subject.data), 1)
+			flash('The mail has been queued for delivery.', 'success')
+			return redirect(url_for('admin.mass_mail'))
+		else:
+			flash('Password Incorrect', 'error')
+
+	return render_template('admin/mass_mail.htm', form=form)
+
+@admin_view.route('/admin/mass_pm', methods=('GET', 'POST'))
+@authz.requires(rights.permission(Group, 'admin:view'), methods=('GET', 'POST'))
+@authz.requires(rights.permission(Group, 'pm:mass'), methods=('GET', 'POST'))
+def mass_pm():
+	form = MassPMForm()
+	form.group.choices = [(0, 'Everyone')] + [(group.id, group.display)
+		for group in Group.query.order_by(Group.name)]
+
+	if form.validate_on_submit():
+		if check_password(form.password.data):
+			#only * is a wildcard, LIKE's own are matched literally.
+			display = form.display.data.replace('\\', '\\\\'). \
+				replace('%', '\\%').replace('_', '\\_').replace('*', '%')
+			send_mass_pm.delay(current_user.id, form.title.data, form.text.data,
+				form.group.data or None, display or None)
+			create_log('Mass PM "{}" was sent'.format(form.title.data), 1)
+			flash('The private message has been queued for delivery.', 'success')
+			return redirect(url_for('admin.mass_pm'))
+		else:
+			flash('Password Incorrect', 'error')
+
+	return render_template('admin/mass_pm.htm', form=form)
+
 @admin_view.route('/admin/theme', methods=('GET', 'POST', 'PUT'))
 @authz.requires(rights.permission(Group, 'admin:view'), methods=('GET' 'POST'))
 @authz.requires(rights.permission(Group, 'forum:edit'), methods=('GET', 'POST', 'PUT'))
@@ -88,7 +134,7 @@ def user_edit(user_id):
 	if request.method == 'POST':
 		if form.validate_on_submit():
 		
-			if current_user.password != form.password.data:
+			if form.password.data != current_user.password:
 				flash('The user credentials specified are invalid.', 'error')
 				return render_template('admin/user_edit.htm',
 					form=form, user=user)
@@ -143,7 +189,7 @@ def admin_view_users(page):
 		abort(404)
 	
 	if form.validate_on_submit():
-		if current_user.password == form.password.data:
+		if form.password.data == current_user.password:
 			users = User.query.filter(User.id.in_(form.selected.data)).all()
 			
 			for user in users:
@@ -241,6 +287,7 @@ def admin_user_group(user_id):
 			flash('User Group Removed Successfully', 'success')
 
 		db.session.commit()
+		invalidate_permissions()
 
 		return redirect(url_for('admin.admin_user_group', user_id=user.id))
 
@@ -285,6 +332,7 @@ def admin_user_perms(user_id):
 			flash('User rights Removed Successfully', 'success')
 
 		db.session.commit()
+		invalidate_permissions()
 		create_log('User {} got given permissions'.format(user.id), 1)
 		return redirect(url_for('admin.admin_user_perms', user_id=user.id))
 
@@ -307,7 +355,7 @@ def group_edit(group_id):
 	if request.method == 'POST':
 		if form.validate_on_submit():
 		
-			if current_user.password != form.password.data:
+			if form.password.data != current_user.password:
 				flash('Password is invalid.', 'error')
 				return render_template('admin/group_edit.htm',
 					form=form, group=group)
@@ -336,6 +384,7 @@ def group_edit(group_id):
 					group.permissions.filter_by(token=right.lower()).delete()
 
 			db.session.commit()
+			invalidate_permissions()
 			create_log('Group: {} given or removed permissions'.format(group.id), 1)
 			flash('Your Changes have been made successfully.', 'success')
 		else:
@@ -359,12 +408,13 @@ def admin_view_groups(page):
 		abort(404)
 
 	if form.validate_on_submit():
-		if current_user.password == form.password.data:
+		if form.password.data == current_user.password:
 			stmt = GroupPermission.__table__.delete(). \
 				where(GroupPermission.group_id.in_(form.selected.data))
 			db.engine.execute(stmt)
 			stmt = Group.__table__.delete().where(Group.id.in_(form.selected.data))
 			db.engine.execute(stmt)
+			invalidate_permissions()
 			create_log('Groups Deleted', 1)
 			return redirect(url_for('admin.admin_view_groups'))
 		else:
@@ -14,13 +14,19 @@ from flask_authz import rights
 import pendulum
 
 from .models import db, authz, Group, User, GroupPermission
+from .models import invalidate_permissions
 from .models import Category, Board, Thread, Post, Log
 from .forms import CategoryCreateForm, BoardCreateForm, BoardEditForm
 from .forms import CategoryEditForm, DeleteForumForm
 from .log import create_log
+from .utils import check_password
+from .fragments import invalidate_fragments
+from .pages import invalidate_pages
+from .forum_tree import forum_tree, invalidate_forum_tree
 
 admin_forum_view = Blueprint('admin_forum', __name__)
 
+#callers must call invalidate_permissions() once the new rights are committed.
 def groups_set_perm(new_right, data):
 	for id in data:
 		group = Group.query.filter_by(id=id).first()
@@ -35,7 +41,7 @@ def groups_set_perm(new_right, data):
 @admin_forum_view.route('/admin/forums', methods=('GET', 'POST'))
 @authz.requires(rights.permission(Group, 'admin:view'), methods=('GET', 'POST'))
 def admin_view_forum():
-	cats = Category.query.order_by(Category.order.asc()).all()
+	cats = forum_tree().categories
 	return render_template('admin/forum.htm', cats=cats)
 
 @admin_forum_view.route('/admin/category_del/<int:id>', methods=('GET', 'POST'))
@@ -49,9 +55,11 @@ def admin_del_category(id):
 		abort(404)
 
 	if form.validate_on_submit():
-		if current_user.password == form.password.data:
+		if check_password(form.password.data):
 			db.session.delete(category)
 			db.session.commit()
+			invalidate_pages()
+			invalidate_forum_tree()
 			create_log('Category: {} Deleted'.format(id), 1)
 			flash('Category Deleted Successfully', 'success')
 			return redirect(url_for('admin_forum.admin_view_forum'))
@@ -71,9 +79,12 @@ def admin_del_board(id):
 		abort(404)
 
 	if form.validate_on_submit():
-		if current_user.password == form.password.data:
+		if check_password(form.password.data):
 			Board.query.filter_by(id=id).delete()
 			db.session.commit()
+			invalidate_fragments('board', id)
+			invalidate_pages()
+			invalidate_forum_tree()
 			create_log('Board: {} Deleted'.format(id), 1)
 			flash('Board Deleted Successfully', 'success')
 			return redirect(url_for('admin_forum.admin_view_forum'))
@@ -91,7 +102,7 @@ def admin_create_category():
 	form.view.choices = [(group.id, '') for group in groups]
 	
 	if form.validate_on_submit():
-		if current_user.password == form.password.data:
+		if check_password(form.password.data):
 			category = Category (
 							title = form.title.data,
 							order = form.order.data,
@@ -110,6 +121,8 @@ def admin_create_category():
 				group.permissions.append(permission)
 
 			db.session.commit()
+			invalidate_permissions()
+			invalidate_forum_tree()
 			create_log('Category {} Created'.format(category.title), 1)
 			flash('Category Added Successfully', 'success')
 			return redirect(url_for('admin_forum.admin_view_forum'))
@@ -133,7 +146,7 @@ def admin_edit_category(id):
 	groups = Group.query.all()
 
 	if form.validate_on_submit():
-		if current_user.password == form.password.data:
+		if check_password(form.password.data):
 			category.title = form.title.data
 			category.order = form.order.data
 
@@ -142,6 +155,8 @@ def admin_edit_category(id):
 				return redirect(url_for('admin_forum.admin_edit_category', id=id))
 				
 			db.session.commit()
+			invalidate_pages()
+			invalidate_forum_tree()
 			create_log('Category {} Edited'.format(id), 1)
 			flash('Category Updated Successfully', 'success')
 			return redirect(url_for('admin_forum.admin_view_forum'))
@@ -159,8 +174,7 @@ def admin_edit_category(id):
 def admin_create_board():
 	form = BoardCreateForm()
 	groups = Group.query.all()
-	boards = Board.query.all()
-	cats = Category.query.all()
+	tree = forum_tree()
 	mustselect = False
 
 	form.category.choices.clear()
@@ -174,15 +188,15 @@ def admin_create_board():
 	form.category.choices.append((0, 'None'))
 	form.parent.choices.append((0, 'None'))
 
-	for category in cats:
+	for category in tree.categories:
 		form.category.choices.append((category.id, category.title))
 
-	for board in boards:
+	for board in tree.ordered_boards:
 		if not board.parent:
 			form.parent.choices.append((board.id, board.title))
 
 	if form.validate_on_submit():
-		if current_user.password == form.password.data:
+		if check_password(form.password.data):
 			board = Board (
 				title = form.title.data,
 				order = form.order.data,
@@ -214,6 +228,8 @@ def admin_create_board():
 					form.poll.data)
 
 				db.session.commit()
+				invalidate_permissions()
+				invalidate_forum_tree()
 				create_log('Created Board {}'.format(board.title), 1)
 				flash('Board Added Successfully', 'success')
 				return redirect(url_for('admin_forum.admin_view_forum'))
@@ -240,11 +256,10 @@ def admin_edit_board(id):
 		abort(404)
 
 	form = BoardEditForm()
-	boards = Board.query.all()
-	cats = Category.query.all()
+	tree = forum_tree()
 
 	if form.validate_on_submit():
-		if current_user.password == form.password.data:
+		if check_password(form.password.data):
 			if cur_board.title != form.title.data.lower():
 				if Board.query.filter_by(title=form.title.data.lower()).first():
 					flash('Title can not be used, please choose Another', 'error')
@@ -287,6 +302,9 @@ def admin_edit_board(id):
 				return redirect(url_for('admin_forum.admin_edit_board', id=id))
 
 			db.session.commit()
+			invalidate_fragments('board', id)
+			invalidate_pages()
+			invalidate_forum_tree()
 			create_log('board: {} Updated'.format(id), 1)
 			flash('Board Updated Successfully', 'success')
 			return redirect(url_for('admin_forum.admin_view_forum'))
@@ -298,10 +316,10 @@ def admin_edit_board(id):
 	form.category.choices.append((0, 'None'))
 	form.parent.choices.append((0, 'None'))
 	
-	for category in cats:
+	for category in tree.categories:
 		form.category.choices.append((category.id, category.title))
 
-	for board in boards:
+	for board in tree.ordered_boards:
 		if not board.parent:
 			form.parent.choices.append((board.id, board.title))
 
@@ -8,10 +8,14 @@
 #  - S.J.R. van Schaik <stephan@synkhronix.com>
 from getpass import getpass
 from datetime import datetime
+from flask_migrate import stamp
 import sys
+import click
 
 from ..models import db, User, Group, GroupPermission, Email, UserPermission
-from ..models import Post, Thread
+from ..models import Post, Thread, PM, Log, Warning, invalidate_permissions
+from ..models.user import user_groups
+from ..search_index import search_index, rebuild_index
 from .user import user
 
 def readline(prompt):
@@ -26,7 +30,7 @@ def setup():
 			'user:view','user:create','user:edit','user:delete',
 			'user:invite','user:permissions', 'user:like',
 			'user:warn','user:ban','user:invisible','user:online',
-			'user:groups','pm:view','pm:send','mail:send',
+			'user:groups','pm:view','pm:send','pm:mass','mail:send',
 			'mail:mass','admin:view','admin:warn','admin:change',
 			'admin:userview','log:view','log:delete','group:view',
 			'group:create','group:edit','group:delete',
@@ -55,8 +59,8 @@ def setup():
 		display='Guest',
 		first_name='Ghosty',
 		last_name='guest',
-		termsagree = True,
-		privacyagree = True,
+		terms_version = 1,
+		privacy_version = 1,
 		)
 
 	db.session.add(user)
@@ -91,6 +95,11 @@ def setup():
 
 	user.groups.append(guest_group)
 	db.session.commit()
+	invalidate_permissions()
+	search_index().create()
+	db.session.commit()
+	#create_all already built the indexes the migrations would add.
+	stamp()
 	print("Setup is completed")
 
 def setup_mass_users():
@@ -159,6 +168,7 @@ def add_user_to_group():
 
 	user.groups.append(group)
 	db.session.commit()
+	invalidate_permissions()
 
 def delete_post():
 	post_id = readline('id: ')
@@ -179,6 +189,141 @@ def delete_post():
 			post.delete()
 		db.session.commit()
 	
+def hot_queries():
+	from ..forum import THREAD_KEYS, POST_KEYS
+	from ..pagination import seek_order
+
+	return [
+		('board threads', 'ix_threads_board_listing',
+			Thread.query.filter_by(board_id=1).
+				order_by(*seek_order(THREAD_KEYS, True)).limit(10)),
+		('thread posts', 'ix_posts_thread_listing',
+			Post.query.filter_by(thread_id=1).
+				order_by(*seek_order(POST_KEYS, True)).limit(10)),
+		('inbox', 'ix_private_messages_inbox',
+			PM.query.filter_by(user_id=1).
+				order_by(PM.date.desc(), PM.id.desc()).limit(25)),
+		('sent messages', 'ix_private_messages_sent',
+			PM.query.filter_by(sender_id=1).
+				order_by(PM.date.desc(), PM.id.desc()).limit(25)),
+		('user groups', 'ix_user_groups_user',
+			db.session.query(user_groups.c.group_id).
+				filter(user_groups.c.user_id==1)),
+		('user permissions', 'ix_user_permissions_user',
+			db.session.query(UserPermission.token).
+				filter(UserPermission.user_id==1)),
+		('group permissions', 'ix_group_permissions_group',
+			db.session.query(GroupPermission.group_id, GroupPermission.token).
+				filter(GroupPermission.group_id.in_([1, 2]))),
+		('logs', 'ix_logs_listing',
+			Log.query.order_by(Log.date.desc(), Log.id.desc()).limit(20)),
+		('expired warnings', 'ix_warnings_date',
+			Warning.query.filter(Warning.date <= datetime.utcnow())),
+	]
+
+def explain_queries():
+	dialect = db.engine.dialect
+
+	for name, index, query in hot_queries():
+		compiled = query.statement.compile(dialect=dialect)
+		params = compiled.params
+
+		if compiled.positional:
+			params = tuple(params[key] for key in compiled.positiontup)
+
+		if dialect.name == 'sqlite':
+			statement = 'EXPLAIN QUERY PLAN {}'.format(compiled)
+		else:
+			statement = 'EXPLAIN {}'.format(compiled)
+
+		plan = [' '.join(str(column) for column in row)
+			for row in db.engine.execute(statement, params)]
+
+		if any(index in line for line in plan):
+			print('{}: uses {}'.format(name, index))
+		else:
+			print('{}: does NOT use {}'.format(name, index))
+
+			for line in plan:
+				print('    {}'.format(line))
+
+@click.option('--fix', is_flag=True, help='Recounts the counters that drifted')
+def check_counters(fix):
+	from ..counters import counter_drift
+	from ..tasks import recount_all_boards_posts, recount_all_users_posts
+
+	drift = counter_drift()
+
+	for table, id, name, stored, actual in drift:
+		print('{} {} {}: stored {}, actual {}'.format(table, id, name, stored,
+			actual))
+
+	print('{} counters drifted.'.format(len(drift)))
+
+	if drift and fix:
+		tables = set(table for table, id, name, stored, actual in drift)
+
+		if tables & set(['boards', 'threads']):
+			recount_all_boards_posts()
+
+		if 'users' in tables:
+			recount_all_users_posts()
+
+		print('Counters were recounted.')
+
+@click.option('--prefix', default='session:',
+	help='The key prefix of the session ids in the sessions table')
+@click.option('--delete', is_flag=True, help='Deletes the copied rows')
+def migrate_sessions(prefix, delete):
+	from ..models import rdb
+	from ..sessions import SESSION_PREFIX
+
+	sessions = db.Table('sessions', db.MetaData(), autoload=True,
+		autoload_with=db.engine)
+	now = datetime.utcnow()
+	copied = 0
+
+	#sessions without an expiry were never kept by the old store either.
+	rows = db.session.execute(db.select([sessions.c.session_id,
+		sessions.c.data, sessions.c.expiry]).where(sessions.c.expiry > now))
+	pipe = rdb.pipeline()
+
+	for session_id, data, expiry in rows:
+		if not session_id.startswith(prefix):
+			continue
+
+		pipe.setex(SESSION_PREFIX + session_id[len(prefix):],
+			max(int((expiry - now).total_seconds()), 1), data)
+		copied += 1
+
+	pipe.execute()
+
+	if delete:
+		db.session.execute(sessions.delete())
+		db.session.commit()
+
+	print('{} sessions were copied to redis.'.format(copied))
+
+@click.argument('address')
+@click.option('--now', is_flag=True,
+	help='Sends from this process instead of queueing for the worker')
+def send_test_mail(address, now):
+	from ..tasks import mail_message, send_async_email
+
+	message = mail_message([address], 'Test mail', 'mail/test.htm', {},
+		'http://localhost:5000/')
+
+	if now:
+		send_async_email([message])
+	else:
+		send_async_email.delay([message])
+
+	print('A test mail was {} for {}.'.format('sent' if now else 'queued',
+		address))
+
+def rebuild_search():
+	print('{} posts were indexed.'.format(rebuild_index()))
+
 class CommandLine(object):
 	def init_app(self, app):
 		app.cli.command('setup')(setup)
@@ -187,5 +332,10 @@ class CommandLine(object):
 		app.cli.add_command(user, 'user')
 		app.cli.command('add-user')(add_user)
 		app.cli.command('add-user-to-group')(add_user_to_group)
+		app.cli.command('explain')(explain_queries)
+		app.cli.command('check-counters')(check_counters)
+		app.cli.command('migrate-sessions')(migrate_sessions)
+		app.cli.command('rebuild-search')(rebuild_search)
+		app.cli.command('send-test-mail')(send_test_mail)
 
 cli = CommandLine()
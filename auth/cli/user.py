@@ -11,6 +11,7 @@ import sys
 import click
 
 from ..models import db, User, UserPermission, Email, Group, GroupPermission
+from ..models import invalidate_permissions, delete_user_pms, forget_tokens
 import flask
 
 user = flask.cli.AppGroup('user')
@@ -64,8 +65,11 @@ def del_user(email):
 	click.confirm('Are you sure you want to delete the user? '
 		'This action cannot be undone.', abort=True)
 
+	user_id = user.id
+	delete_user_pms(user_id)
 	db.session.delete(user)
 	db.session.commit()
+	forget_tokens(user_id)
 
 @user_email.command('list')
 def list_users():
@@ -108,6 +112,7 @@ def add_group(email, group):
 
 	user.groups.append(group)
 	db.session.commit()
+	invalidate_permissions()
 
 @user_group.command('del')
 @click.option('--email', prompt=True)
@@ -127,6 +132,7 @@ def del_group(email, group):
 
 	user.groups.remove(group)
 	db.session.commit()
+	invalidate_permissions()
 
 @user_rights.command('list', help='Lists the effective rights of the user')
 @click.option('--email', prompt=True)
@@ -166,6 +172,7 @@ def add_right(email, right):
 	user.permissions.append(right)
 
 	db.session.commit()
+	invalidate_permissions()
 
 @user_rights.command('add_by_display', help='Adds the user right')
 @click.option('--display', prompt=True)
@@ -182,6 +189,7 @@ def add_right_by_display(display, right):
 	user.permissions.append(right)
 
 	db.session.commit()
+	invalidate_permissions()
 	
 @user_rights.command('del', help='Deletes the user right')
 @click.option('--email', prompt=True)
@@ -195,3 +203,4 @@ def del_right(email, right):
 
 	right = user.permissions.filter_by(token=right).delete()
 	db.session.commit()
+	invalidate_permissions()
@@ -0,0 +1,87 @@
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author(s):
+#  - Andrew Wheeler <lordsatin@hotmail.com>
+#
+from .models import db, User, Board, Thread, Post
+
+def count(column, key, *joins):
+	#correlated COUNT, each row of the updated table counts its own rows.
+	query = db.select([db.func.count()])
+
+	for join in joins:
+		query = query.select_from(join)
+
+	return query.where(column == key).as_scalar()
+
+#the true value of every denormalized counter, per model.
+USER_COUNTERS = {
+	'threadnum': count(Thread.creator_id, User.id),
+	'postnum': count(Post.creator_id, User.id),
+}
+THREAD_COUNTERS = {
+	'post_count': count(Post.thread_id, Thread.id),
+}
+BOARD_COUNTERS = {
+	'threads': count(Thread.board_id, Board.id),
+	'post_count': count(Thread.board_id, Board.id,
+		db.join(Post.__table__, Thread.__table__, Post.thread_id == Thread.id)),
+}
+COUNTERS = ((User, USER_COUNTERS), (Thread, THREAD_COUNTERS),
+	(Board, BOARD_COUNTERS))
+
+def increment(model, id, **deltas):
+	#col = col + delta is applied by the database, so concurrent writers
+	#never overwrite each other's counts with a stale value.
+	db.session.execute(model.__table__.update().where(model.id == id).
+		values(dict((name, getattr(model, name) + delta)
+			for name, delta in deltas.items())))
+
+class Counters(object):
+	"""Collects counter deltas and applies them with atomic UPDATEs.
+
+	Deltas for the same row are summed so each row is written once, and
+	rows are written in table and id order so concurrent requests lock
+	them in the same order.
+	"""
+
+	def __init__(self):
+		self.deltas = {}
+
+	def add(self, model, id, **deltas):
+		row = self.deltas.setdefault((model.__tablename__, id, model), {})
+
+		for name, delta in deltas.items():
+			row[name] = row.get(name, 0) + delta
+
+		return self
+
+	def apply(self):
+		for (table, id, model), deltas in sorted(self.deltas.items(),
+			key=lambda item: item[0][:2]):
+			deltas = dict((name, delta) for name, delta in deltas.items()
+				if delta)
+
+			if deltas:
+				increment(model, id, **deltas)
+
+		self.deltas.clear()
+
+def counter_drift():
+	"""Returns (table, id, counter, stored, actual) for every counter that
+	does not match the true count of its rows.
+	"""
+	drift = []
+
+	for model, counters in COUNTERS:
+		for name, actual in counters.items():
+			stored = db.func.coalesce(getattr(model, name), 0)
+
+			for id, value, real in db.session.query(model.id, stored, actual). \
+				filter(stored != actual).order_by(model.id):
+				drift.append((model.__tablename__, id, name, value, real))
+
+	return drift
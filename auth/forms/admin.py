@@ -197,4 +197,22 @@ class InfoForm(FlaskForm):
 	recountboard = SubmitField('Recount board posts')
 	recountuser = SubmitField('Recount user posts')
 	resetterms = SubmitField('Reset the Terms Agreements')
-	resetprivacy = SubmitField('Reset the Privacy Agreements')
\ No newline at end of file
+	resetprivacy = SubmitField('Reset the Privacy Agreements')
+
+class MassMailForm(FlaskForm):
+	group = SelectField('Group', choices=[], coerce=int)
+	subject = TextField('Subject', validators=[validators.Required(),
+		validators.Length(max=128)])
+	body = TextAreaField('Message', validators=[validators.Required(),
+		validators.Length(min=15, max=8192)])
+	password = PasswordField('Password', validators=[validators.Required()])
+
+class MassPMForm(FlaskForm):
+	group = SelectField('Group', choices=[], coerce=int)
+	display = TextField('Display name', validators=[validators.Length(max=256)],
+		description='Only users whose display name matches, * matches anything.')
+	title = TextField('Title', validators=[validators.Required(),
+		validators.Length(min=4, max=256)])
+	text = CKEditorField('Text', validators=[validators.Required(),
+		validators.Length(min=8, max=8192)])
+	password = PasswordField('Password', validators=[validators.Required()])
@@ -45,4 +45,12 @@ class PostForm(FlaskForm):
 
 class PostsForm(FlaskForm):
 	password = PasswordField('Password', validators=[validators.Required()])
-	selected = MultiCheckboxField('Selected', choices=[], coerce=int)
\ No newline at end of file
+	selected = MultiCheckboxField('Selected', choices=[], coerce=int)
+
+class SearchForm(FlaskForm):
+	class Meta:
+		csrf = False
+
+	query = TextField('Search',
+		validators=[validators.Required(),
+		validators.Length(max=128)])
\ No newline at end of file
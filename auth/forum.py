@@ -12,27 +12,34 @@ from flask import abort, Blueprint, flash, redirect, render_template, request
 from flask import current_app, url_for, session
 from flask_login import current_user
 from flask_authz import rights
+from sqlalchemy.orm import joinedload
 import redis
 import pendulum
 
 from .forms import BoardViewForm, BoardMoveForm, ThreadCreateForm, PostsForm
 from .forms import PostForm, BoardDeleteForm
-from .models import db, authz, Group, User, Email, rdb, UserOnline
-from .models import Category, Board, Thread, Post, Log
+from .models import db, authz, Group, User, Email, online_users
+from .models import policy_versions
+from .models import current_tokens
+from .models import Board, Thread, Post, Log
 from .log import create_log
+from .utils import check_password
+from .pagination import seek_paginate
+from .counters import Counters, increment
+from .fragments import cached_fragments, invalidate_fragments
+from .pages import guest_cached, invalidate_pages
+from .search_index import index_posts, unindex_posts
+from .forum_tree import forum_tree
 
 forum_view = Blueprint('forum', __name__)
 
+#(column, descending) keys the board and thread pages are ordered and seeked on.
+THREAD_KEYS = ((Thread.sticky, True), (Thread.last_post, False), (Thread.id, False))
+POST_KEYS = ((Post.thread_post, True), (Post.post_time, False), (Post.id, False))
+
 @forum_view.app_template_global()
 def check_right(right):
-	for group in current_user.groups:
-		if group.permissions.filter_by(token=right).first() is not None:
-			return True
-
-	if current_user.permissions.filter_by(token=right).first() is not None:
-		return True
-	else:
-		return False
+	return right in current_tokens()
 
 @forum_view.app_template_global()
 def category_viewable(id):
@@ -48,47 +55,88 @@ def board_viewable(id):
 
 	return check_right('forum:view:{}'.format(id))
 
+def viewable_forums(tokens):
+	categories = set()
+	boards = set()
+	all_categories = False
+	all_boards = False
+
+	for token in tokens:
+		if token == 'category:view':
+			all_categories = True
+		elif token == 'forum:view':
+			all_boards = True
+		elif token.startswith('category:view:'):
+			id = token[len('category:view:'):]
+
+			if id.isdigit():
+				categories.add(int(id))
+		elif token.startswith('forum:view:'):
+			id = token[len('forum:view:'):]
+
+			if id.isdigit():
+				boards.add(int(id))
+
+	if all_categories:
+		categories = set(category.id for category in forum_tree().categories)
+
+	if all_boards:
+		boards = set(forum_tree().boards)
+
+	return categories, boards
+
+def load_boards(ids):
+	#the counters and last post, thread and poster of the boards that are
+	#shown, loaded up front so the board items do not lazy load them.
+	if not ids:
+		return []
+
+	return Board.query.options(
+		joinedload(Board.last_post).joinedload(Post.thread),
+		joinedload(Board.last_post).joinedload(Post.creator).
+			joinedload(User.email)
+	).filter(Board.id.in_(ids)).order_by(Board.order, Board.id).all()
+
 @forum_view.app_template_global()
 def get_current_user():
 	return current_user
 
 @forum_view.route('/', methods=('GET', 'POST'))
 @forum_view.route('/forum', methods=('GET', 'POST'))
+@guest_cached
 def view_forum():
 
 	if not current_user.is_anonymous():
-		if not current_user.privacyagree:
+		versions = policy_versions()
+
+		if current_user.privacy_version < versions['privacy']:
 			flash('You must accept the new Privacy Policy to continue using the Software.', 'error')
 			return redirect(url_for('user.user_privacy'))
 					
-		if  not current_user.termsagree:
+		if current_user.terms_version < versions['terms']:
 			flash('You must accepted the new Terms and Conditions to continue using the Software.', 'error')
 			return redirect(url_for('user.user_agreement'))
 
-	categories = Category.query.all()
-	can_see_boards = False
-	online = []
-	cursor_number = 0
-
-	for category in categories:
-		if category_viewable(category.id):
-			for board in category.category_boards:
-				if board_viewable(board.id):
-					can_see_boards = True
-					break
-			if can_see_boards:
-				break
+	categories = forum_tree().categories
+	viewable_categories, viewable_boards = viewable_forums(current_tokens())
+	category_boards = dict((category.id, category.category_boards)
+		for category in categories)
+	can_see_boards = any(board.id in viewable_boards
+		for category in categories if category.id in viewable_categories
+		for board in category.category_boards)
+	shown = [board.id for category in categories
+		if category.id in viewable_categories
+		for board in category.category_boards
+		if not board.parent_id and board.id in viewable_boards]
 
 	#show only 50 online users as to not burden the page.
-	cursor_number, keys = rdb.execute_command('scan', cursor_number, "count", 50)
-	
-	for key in keys:
-		display = rdb.get(key).decode('utf-8')
-		user_online = UserOnline (id = key.decode('utf-8'), display=display,)		
-		online.append(user_online)
-		
+	online, online_count = online_users(50)
+	board_fragments = cached_fragments('board', load_boards(shown))
+
 	return render_template('forum/forum.htm', categories=categories,
-		can_see_boards=can_see_boards, online=online)
+		can_see_boards=can_see_boards, online=online, online_count=online_count,
+		category_boards=category_boards, board_fragments=board_fragments,
+		viewable_categories=viewable_categories, viewable_boards=viewable_boards)
 
 @forum_view.route('/forum/board/<int:board_id>', methods=('GET', 'POST'),
 	defaults={'page': 1})
@@ -103,16 +151,11 @@ def view_forum():
 	rights.permission(Group, 'thread:remove'),
 	rights.permission(Group, 'thread:sticky')
 ), methods=('POST'))
+@guest_cached
 def view_board(board_id, page):
 	board = Board.query.get(board_id) or abort(404)
-	viewable = False
-
-	if board.board_threads:
-		threads_page = Thread.query.filter_by(board_id=board.id).\
-			order_by(Thread.sticky.desc(),Thread.last_post.asc()).paginate(page,
-			current_app.config['THREADS_PER_PAGE'], False)
-	else:
-		thread_page = None
+	threads_page = seek_paginate(Thread.query.filter_by(board_id=board.id),
+		THREAD_KEYS, page, current_app.config['THREADS_PER_PAGE'], board.threads)
 
 	if not threads_page.items and page != 1:
 		abort(404)
@@ -124,7 +167,7 @@ def view_board(board_id, page):
 	form.selected.choices = [(thread.id, '') for thread in threads_page.items]
 
 	if form.validate_on_submit():
-		if current_user.password != form.password.data:
+		if not check_password(form.password.data):
 			flash('Password incorrect', 'error')
 			return redirect(url_for('forum.view_board', board_id=board_id, page=page))
 
@@ -135,6 +178,7 @@ def view_board(board_id, page):
 				thread.sticky = True;
 
 			db.session.commit()
+			invalidate_pages()
 			create_log('Threads Made Sticky', 1)
 			flash('Selected Topics marked as sticky', 'success')
 			return redirect(url_for('forum.view_board', board_id=board_id, page=page))
@@ -145,6 +189,7 @@ def view_board(board_id, page):
 				thread.sticky = False;
 
 			db.session.commit()
+			invalidate_pages()
 			create_log('Threads Made UnSticky', 1)
 			flash('Selected Topics no longer sticky', 'success')
 			return redirect(url_for('forum.view_board', board_id=board_id, page=page))
@@ -155,13 +200,16 @@ def view_board(board_id, page):
 			session['mod_selection'] = form.selected.data
 			return redirect(url_for('forum.board_delete_threads', board_id=board_id))
 
-	for sub_board in board.board_boards:
-		if board_viewable(sub_board.id):
-			viewable = True
-	
+	viewable_categories, viewable_boards = viewable_forums(current_tokens())
+	node = forum_tree().boards.get(board.id)
+	sub_boards = load_boards([sub_board.id for sub_board in node.board_boards
+		if sub_board.id in viewable_boards]) if node and not node.parent_id else []
 	threads = zip(form.selected, threads_page.items) if threads_page.items else None
+	thread_fragments = cached_fragments('thread', threads_page.items,
+		board=board)
 	return render_template('forum/board.htm', form=form, board=board,
-		threads=threads, pages=threads_page, viewable=viewable, user=current_user)
+		threads=threads, pages=threads_page, sub_boards=sub_boards,
+		thread_fragments=thread_fragments, user=current_user)
 
 @forum_view.route('/forum/board/<int:board_id>/move',
 	methods=('GET', 'POST'))
@@ -176,11 +224,11 @@ def view_board(board_id, page):
 @authz.requires(rights.permission(Group, 'thread:move'), methods=('POST'))
 def board_move_threads(board_id):
 	form = BoardMoveForm()
-	boards = Board.query.all()
 	cur_board = Board.query.get(board_id) or abort(404)
 	board_last_reset = False
 
-	form.boards.choices = [(board.id, board.title) for board in boards]
+	form.boards.choices = [(board.id, board.title)
+		for board in forum_tree().ordered_boards]
 
 	selected = session.get('mod_selection', [])
 
@@ -189,29 +237,30 @@ def board_move_threads(board_id):
 		return redirect(url_for('forum.view_board', board_id=form.boards.data))
 
 	if form.validate_on_submit():
-		if current_user.password == form.password.data:
+		if check_password(form.password.data):
 			threads = Thread.query.filter(Thread.id.in_(selected)).all()
+			new_parent = Board.query.get(form.boards.data) or abort(404)
+			counters = Counters()
 
-			for thread in threads:
-				new_parent = Board.query.filter_by(id=form.boards.data).first()
-				
-				if new_parent.link:
-					flash('Can not move to a linked board', 'error')
-					return redirect(url_for('forum.view_board', board_id=board_id))
+			if new_parent.link:
+				flash('Can not move to a linked board', 'error')
+				return redirect(url_for('forum.view_board', board_id=board_id))
 
+			for thread in threads:
 				if cur_board.last_post.id == thread.last.id:
 					board_last_reset = True
 
 				if new_parent.last_post.post_time < thread.last.post_time:
 					new_parent.last_post = thread.last
 
-				cur_board.post_count -= thread.post_count
-				cur_board.threads -= 1
+				counters.add(Board, cur_board.id, threads=-1,
+					post_count=-thread.post_count)
+				counters.add(Board, new_parent.id, threads=1,
+					post_count=thread.post_count)
 				cur_board.board_threads.remove(thread)
 				new_parent.board_threads.append(thread)
-				new_parent.post_count += thread.post_count
-				new_parent.threads += 1
 
+			counters.apply()
 			db.session.commit()
 			
 			if board_last_reset:
@@ -225,6 +274,9 @@ def board_move_threads(board_id):
 
 				db.session.commit()
 
+			invalidate_fragments('board', cur_board.id, new_parent.id)
+			invalidate_fragments('thread', *selected)
+			invalidate_pages()
 			create_log('Threads were moved to board {}'.format(new_parent.id), 1)
 			return redirect(url_for('forum.view_board', board_id=form.boards.data))
 		else:
@@ -254,8 +306,10 @@ def board_delete_threads(board_id):
 		return redirect(url_for('forum.view_board', board_id=form.boards.data))
 
 	if form.validate_on_submit():
-		if current_user.password == form.password.data:
+		if check_password(form.password.data):
 			threads = Thread.query.filter(Thread.id.in_(selected)).all()
+			counters = Counters()
+			removed = []
 			
 			for thread in threads:
 				if thread.board_id != board.id:
@@ -265,13 +319,16 @@ def board_delete_threads(board_id):
 					board_last_reset = True
 					board.last_post = None
 
-				board.post_count -= thread.post_count
-				board.threads -= 1
-				thread.creator.threadnum -=1
+				counters.add(Board, board.id, threads=-1)
+				counters.add(User, thread.creator_id, threadnum=-1)
 				for post in thread.thread_posts:
-					post.creator.postnum -=1
+					counters.add(Board, board.id, post_count=-1)
+					counters.add(User, post.creator_id, postnum=-1)
+					removed.append(post.id)
 
 				db.session.delete(thread)
+			counters.apply()
+			unindex_posts(*removed)
 			db.session.commit()
 			
 			if board_last_reset:
@@ -283,6 +340,8 @@ def board_delete_threads(board_id):
 
 				db.session.commit()
 
+			invalidate_fragments('board', board.id)
+			invalidate_pages()
 			create_log('Threads Deleted', 1)
 			return redirect(url_for('forum.view_board', board_id=board_id))
 		else:
@@ -308,7 +367,7 @@ def board_create_threads(board_id):
 	board = Board.query.get(board_id) or abort(404)
 
 	if form.validate_on_submit():
-		if current_user.password == form.password.data:
+		if check_password(form.password.data):
 
 			thread = Thread (
 				title=form.title.data,
@@ -331,11 +390,12 @@ def board_create_threads(board_id):
 			thread.last_post = post.post_time
 			thread.last = post
 			thread.board.last_post = post
-			current_user.postnum += 1
-			current_user.threadnum += 1
-			board.threads += 1
-			board.post_count += 1
+			increment(User, current_user.id, postnum=1, threadnum=1)
+			increment(Board, board.id, threads=1, post_count=1)
+			index_posts(post)
 			db.session.commit()
+			invalidate_fragments('board', board.id)
+			invalidate_pages()
 
 			return redirect(url_for('forum.board_view_posts',
 				board_id=board_id, thread_id=thread.id))
@@ -361,12 +421,15 @@ def board_create_threads(board_id):
 		rights.permission(Group, 'forum:mod:{board_id}')),
 	rights.permission(Group, 'thread:remove')
 ), methods=('POST'))
+@guest_cached
 def board_view_posts(board_id, thread_id, page):
 	form = ThreadCreateForm()
-	thread = Thread.query.get(thread_id) or abort(404)
-	post_page = Post.query.filter_by(thread_id=thread_id). \
-		order_by(Post.thread_post.desc(),Post.post_time.asc()).paginate(page,
-			current_app.config['POSTS_PER_PAGE'], False)
+	thread = Thread.query.options(joinedload(Thread.board)).get(thread_id) or \
+		abort(404)
+	post_page = seek_paginate(Post.query.filter_by(thread_id=thread_id).options(
+		joinedload(Post.creator).joinedload(User.email),
+		joinedload(Post.editor).joinedload(User.email)), POST_KEYS, page,
+		current_app.config['POSTS_PER_PAGE'], thread.post_count)
 
 	if not post_page.items and page != 1:
 		abort(404)
@@ -375,13 +438,14 @@ def board_view_posts(board_id, thread_id, page):
 	form.selected.choices = [(post.id, '') for post in post_page.items]
 
 	if form.validate_on_submit():
-		if current_user.password != form.password.data:
+		if not check_password(form.password.data):
 			flash('Password incorrect', 'error')
 			return redirect(url_for('forum.board_view_posts',
 				board_id=board_id, thread_id=thread_id, page=page))
 
 		if form.selected.data:
 			posts = Post.query.filter(Post.id.in_(form.selected.data)).all()
+			counters = Counters()
 			change_time = False
 			last_id = 0
 
@@ -393,9 +457,9 @@ def board_view_posts(board_id, thread_id, page):
 				if post.thread_id != thread_id:
 					abort(404)
 
-				thread.board.post_count -= 1
-				thread.post_count -= 1
-				post.creator.postnum -=1
+				counters.add(Board, thread.board_id, post_count=-1)
+				counters.add(Thread, thread.id, post_count=-1)
+				counters.add(User, post.creator_id, postnum=-1)
 
 				if thread.last_post == post.post_time:
 					change_time = True
@@ -412,7 +476,12 @@ def board_view_posts(board_id, thread_id, page):
 				if thread.board.last_id == last_id:
 					thread.board.last_post = old_post
 
+			counters.apply()
+			unindex_posts(*[post.id for post in posts])
 			db.session.commit()
+			invalidate_fragments('thread', thread.id)
+			invalidate_fragments('board', thread.board_id)
+			invalidate_pages()
 			create_log('Posts were removed', 1)
 			flash('Posts were removed', 'success')
 		return redirect(url_for('forum.board_view_posts',
@@ -440,7 +509,7 @@ def board_create_post(board_id, thread_id):
 	thread = Thread.query.get(thread_id) or abort(404)
 
 	if form.validate_on_submit():
-		if current_user.password == form.password.data:
+		if check_password(form.password.data):
 
 			post = Post (
 				message = form.text.data.replace('http:', 'https:'),
@@ -452,13 +521,17 @@ def board_create_post(board_id, thread_id):
 
 			current_user.user_posts.append(post)
 			thread.thread_posts.append(post)
-			current_user.postnum += 1
-			thread.post_count += 1
-			thread.board.post_count += 1
+			increment(User, current_user.id, postnum=1)
+			increment(Thread, thread.id, post_count=1)
+			increment(Board, thread.board_id, post_count=1)
 			thread.last_post = post.post_time
 			thread.last = post
 			thread.board.last_post = post
+			index_posts(post)
 			db.session.commit()
+			invalidate_fragments('thread', thread.id)
+			invalidate_fragments('board', thread.board_id)
+			invalidate_pages()
 
 			return redirect(url_for('forum.board_view_posts',
 							board_id=board_id, thread_id=thread_id))
@@ -489,7 +562,7 @@ def board_edit_post(board_id, thread_id, post_id):
 			abort(404)
 
 	if form.validate_on_submit():
-		if current_user.password == form.password.data:
+		if check_password(form.password.data):
 
 			post.message = form.text.data
 			post.edit_time = datetime.utcnow()
@@ -498,7 +571,9 @@ def board_edit_post(board_id, thread_id, post_id):
 				post.editor.edited_posts.remove(post)
 
 			current_user.edited_posts.append(post)
+			index_posts(post)
 			db.session.commit()
+			invalidate_pages()
 			create_log('Post:{} was Edited'.format(post_id), 2)
 			return redirect(url_for('forum.board_view_posts',
 							board_id=board_id, thread_id=thread_id))
@@ -529,7 +604,7 @@ def board_reply_post(board_id, thread_id, post_id):
 	thread = Thread.query.get(thread_id) or abort(404)
 
 	if form.validate_on_submit():
-		if current_user.password == form.password.data:
+		if check_password(form.password.data):
 			post = Post (
 				message = form.text.data.replace('http:', 'https:'),
 				thread_post = False,
@@ -540,13 +615,17 @@ def board_reply_post(board_id, thread_id, post_id):
 
 			current_user.user_posts.append(post)
 			thread.thread_posts.append(post)
-			current_user.postnum += 1
-			thread.post_count += 1
-			thread.board.post_count += 1
+			increment(User, current_user.id, postnum=1)
+			increment(Thread, thread.id, post_count=1)
+			increment(Board, thread.board_id, post_count=1)
 			thread.last_post = post.post_time
 			thread.last = post
 			thread.board.last_post = post
+			index_posts(post)
 			db.session.commit()
+			invalidate_fragments('thread', thread.id)
+			invalidate_fragments('board', thread.board_id)
+			invalidate_pages()
 
 			return redirect(url_for('forum.board_view_posts',
 							board_id=board_id, thread_id=thread_id))
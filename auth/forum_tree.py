@@ -0,0 +1,89 @@
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author(s):
+#  - Andrew Wheeler <lordsatin@hotmail.com>
+#
+from flask import g
+
+from .models import db, rdb, Category, Board
+
+FORUM_TREE_VERSION = 'forums:version'
+
+class CategoryNode(object):
+	def __init__(self, id, title, order):
+		self.id = id
+		self.title = title
+		self.order = order
+		self.category_boards = []
+
+class BoardNode(object):
+	def __init__(self, id, title, desc, link, order, category_id, parent_id):
+		self.id = id
+		self.title = title
+		self.desc = desc
+		self.link = link
+		self.order = order
+		self.category_id = category_id
+		self.parent_id = parent_id
+		self.parent = None
+		self.board_boards = []
+
+class ForumTree(object):
+	"""The categories, boards and sub boards of the forum in display order.
+
+	Nodes carry the same attribute names as the models so templates can
+	walk either, but hold no counters or last posts, those still come from
+	the database.
+	"""
+
+	def __init__(self, version):
+		self.version = version
+		self.categories = [CategoryNode(*row) for row in
+			db.session.query(Category.id, Category.title, Category.order).
+				order_by(Category.order, Category.id)]
+		self.ordered_boards = [BoardNode(*row) for row in
+			db.session.query(Board.id, Board.title, Board.desc, Board.link,
+				Board.order, Board.category_id, Board.parent_id).
+				order_by(Board.order, Board.id)]
+		self.boards = dict((board.id, board) for board in self.ordered_boards)
+		categories = dict((category.id, category) for category in self.categories)
+
+		for board in self.ordered_boards:
+			if board.parent_id in self.boards:
+				board.parent = self.boards[board.parent_id]
+				board.parent.board_boards.append(board)
+
+			if board.category_id in categories:
+				categories[board.category_id].category_boards.append(board)
+
+tree = None
+
+def forum_tree():
+	"""Returns this process's copy of the forum tree.
+
+	The version is read from redis once per request and the tree is
+	rebuilt when another process has bumped it.
+	"""
+	global tree
+
+	cached = g.get('forum_tree')
+
+	if cached is not None:
+		return cached
+
+	#read the version before the rows, a tree loaded mid-change is then
+	#labelled with the older version and rebuilt on the next request.
+	version = int(rdb.get(FORUM_TREE_VERSION) or 0)
+
+	if tree is None or tree.version != version:
+		tree = ForumTree(version)
+
+	g.forum_tree = tree
+	return tree
+
+def invalidate_forum_tree():
+	rdb.incr(FORUM_TREE_VERSION)
+	g.pop('forum_tree', None)
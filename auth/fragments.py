@@ -0,0 +1,70 @@
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author(s):
+#  - Andrew Wheeler <lordsatin@hotmail.com>
+#
+from flask import current_app, render_template
+from flask_login import current_user
+from markupsafe import Markup
+
+from .models import rdb
+
+def fragment_key(kind, id):
+	return 'fragment:{}:{}'.format(kind, id)
+
+def board_version(board):
+	return '{}:{}:{}'.format(board.last_id, board.threads, board.post_count)
+
+def thread_version(thread):
+	return '{}:{}'.format(thread.last_id, thread.post_count)
+
+FRAGMENTS = {
+	'board': ('components/board-item.html', board_version),
+	'thread': ('components/thread-item.html', thread_version),
+}
+
+def cached_fragments(kind, items, **context):
+	"""Returns the rendered component of each item, keyed by item id.
+
+	Every item has a redis hash of fragments, one per version of its
+	counters and timezone the timestamps were converted to. All hashes are
+	read in one pipeline and only the missing fragments are rendered.
+	"""
+	template, version = FRAGMENTS[kind]
+	items = list(items)
+	fields = ['{}:{}'.format(version(item), current_user.timezone)
+		for item in items]
+
+	pipe = rdb.pipeline()
+
+	for item, field in zip(items, fields):
+		pipe.hget(fragment_key(kind, item.id), field)
+
+	cached = pipe.execute()
+	cache_time = current_app.config.get('FRAGMENT_CACHE_TIME', 3600)
+	fragments = {}
+	pipe = rdb.pipeline()
+
+	for item, field, html in zip(items, fields, cached):
+		if html is None:
+			context[kind] = item
+			html = render_template(template, **context)
+			pipe.hset(fragment_key(kind, item.id), field, html)
+			pipe.expire(fragment_key(kind, item.id), cache_time)
+		else:
+			html = html.decode('utf-8')
+
+		fragments[item.id] = Markup(html)
+
+	pipe.execute()
+
+	return fragments
+
+def invalidate_fragments(kind, *ids):
+	keys = [fragment_key(kind, id) for id in ids if id is not None]
+
+	if keys:
+		rdb.delete(*keys)
@@ -14,7 +14,7 @@ from flask_login import current_user
 from flask_authz import rights
 
 from .models import db, authz, Group, User, Log
-from .utils import mail, parse_token, sign_token
+from .utils import mail, parse_token, sign_token, check_password
 from .forms import LogForm
 
 log_view = Blueprint('logs', __name__)
@@ -34,7 +34,8 @@ def create_log(event='unknown event', type=2):
 @authz.requires(rights.permission(Group, 'log:view'), methods=('GET', 'POST'))
 @authz.requires(rights.permission(Group, 'log:delete'), methods=('POST'))
 def view_logs(page):
-	log_page = Log.query.paginate(page, current_app.config['LOGS_PER_PAGE'], False)
+	log_page = Log.query.order_by(Log.date.desc(), Log.id.desc()). \
+		paginate(page, current_app.config['LOGS_PER_PAGE'], False)
 	form = LogForm()
 
 	if not log_page.items and page != 1:
@@ -43,7 +44,7 @@ def view_logs(page):
 	form.selected.choices = [(log.id, '') for log in log_page.items]
 
 	if form.validate_on_submit():
-		if current_user.password == form.password.data:
+		if check_password(form.password.data):
 			logs = Log.query.filter(Log.id.in_(form.selected.data)).all()
 			
 			for log in logs:
@@ -31,6 +31,9 @@ def get_menu():
 	if authz.check(rights.permission(Group, 'user:view')):
 		nav.append(('User List', url_for('user.view_users')))
 
+	if authz.check(rights.permission(Group, 'thread:view')):
+		nav.append(('Search', url_for('search.search')))
+
 	if authz.check(rights.permission(Group, 'admin:view')):
 		nav.append(('Admin Panel', url_for('admin.info')))
 		
@@ -6,8 +6,13 @@
 # Author(s):
 #  - S.J.R. van Schaik <stephan@synkhronix.com>
 from .model import db, migrate, rdb
-from .user import login_manager, authz
+from .user import login_manager, authz, current_tokens, invalidate_permissions
+from .user import forget_tokens
 from .user import User, UserPermission, Email, UserOnline
-from .user import Group, GroupPermission, Warning, PM
+from .user import password_options
+from .user import mark_online, online_users, prune_online, ONLINE_LASTACTIVE
+from .user import Group, GroupPermission, Warning, PM, PMBody
+from .user import pm_body, release_pm_bodies, delete_user_pms, unused_pm_bodies
 from .forum import Category, Board, Thread, Post
-from .logs import Log
\ No newline at end of file
+from .logs import Log
+from .policy import Policy, policy_versions, publish_policy
\ No newline at end of file
@@ -82,4 +82,13 @@ class Post(db.Model):
 			lazy='dynamic'), foreign_keys='Post.editor_id')
 	thread = db.relationship('Thread',
 		backref=db.backref('thread_posts', cascade='all, delete',
-			lazy='dynamic'), foreign_keys='Post.thread_id')
\ No newline at end of file
+			lazy='dynamic'), foreign_keys='Post.thread_id')
+
+#board thread listing, thread post listing and the per user lookups used when
+#recounting or deleting a user's content.
+db.Index('ix_threads_board_listing', Thread.board_id, Thread.sticky.desc(),
+	Thread.last_post, Thread.id)
+db.Index('ix_threads_creator', Thread.creator_id)
+db.Index('ix_posts_thread_listing', Post.thread_id, Post.thread_post.desc(),
+	Post.post_time, Post.id)
+db.Index('ix_posts_creator', Post.creator_id)
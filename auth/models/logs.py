@@ -24,6 +24,8 @@ class Log(db.Model):
 		backref=db.backref('users_logs', cascade='all, delete',
 			lazy='dynamic'), foreign_keys='Log.user_id')
 
+db.Index('ix_logs_listing', Log.date, Log.id)
+
 # rows = session.query(Congress).count()
 # from sqlalchemy import func
 # rows = session.query(func.count(Congress.id)).scalar()
\ No newline at end of file
@@ -0,0 +1,47 @@
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author(s):
+#  - Andrew Wheeler <lordsatin@hotmail.com>
+
+from datetime import datetime
+
+from flask import g
+
+from .model import db
+
+#versions start at 1, users start at 0 until they accept.
+POLICIES = ('terms', 'privacy')
+
+class Policy(db.Model):
+	__tablename__ = 'policies'
+
+	name = db.Column(db.String(32), primary_key=True)
+	version = db.Column(db.Integer(), default=1)
+	date = db.Column(db.DateTime, default=datetime.utcnow)
+
+def policy_versions():
+	if 'policy_versions' not in g:
+		versions = dict((name, 1) for name in POLICIES)
+		versions.update(db.session.query(Policy.name, Policy.version))
+		g.policy_versions = versions
+
+	return g.policy_versions
+
+def publish_policy(name):
+	"""Publishes a new version of a policy.
+
+	Users compare the version they accepted against the current one, so
+	this is a single row write no matter how many users there are.
+	"""
+	updated = Policy.query.filter_by(name=name).update({
+		Policy.version: Policy.version + 1,
+		Policy.date: datetime.utcnow(),
+	}, synchronize_session=False)
+
+	if not updated:
+		db.session.add(Policy(name=name, version=2))
+
+	g.pop('policy_versions', None)
@@ -6,14 +6,19 @@
 # Author(s):
 #  - Andrew Wheeler <lordsatin@hotmail.com>
 #  - S.J.R. van Schaik <stephan@synkhronix.com>
+from sqlalchemy.dialects import postgresql
 from sqlalchemy_utils import EmailType, PasswordType
-from flask import abort, current_app
+from flask import abort, current_app, g
 from flask_login import current_user, LoginManager, UserMixin
 from flask_authz import Authz, SecurityContext
 
+from collections import Counter
 from datetime import datetime
+import hashlib
+import json
+import time
 
-from .model import db
+from .model import db, rdb
 
 login_manager = LoginManager()
 authz = Authz()
@@ -23,6 +28,20 @@ user_groups = db.Table('user_groups',
 	db.Column('group_id', db.Integer, db.ForeignKey('groups.id'))
 )
 
+def password_options(**kwargs):
+	options = dict(schemes=current_app.config.get('PASSWORD_SCHEMES', ['bcrypt']))
+	rounds = current_app.config.get('BCRYPT_ROUNDS')
+
+	#pinning the rounds makes hashes of any other cost need an update, which
+	#rehashes them on their next sign in.
+	if rounds and 'bcrypt' in options['schemes']:
+		options.update(bcrypt__default_rounds=rounds, bcrypt__min_rounds=rounds,
+			bcrypt__max_rounds=rounds)
+
+	options.update(kwargs)
+
+	return options
+
 class User(db.Model, UserMixin, SecurityContext):
 	__tablename__ = 'users'
 
@@ -32,10 +51,8 @@ class User(db.Model, UserMixin, SecurityContext):
 	activated = db.Column(db.Boolean(), default=False)
 	username = db.Column(db.String(256), unique=True)
 	display = db.Column(db.String(256), unique=True)
-	password = db.Column(PasswordType(onload=lambda **kwargs: dict(
-			schemes=current_app.config.get('PASSWORD_SCHEMES', ['bcrypt']),
-			**kwargs
-		)))
+	password = db.Column(PasswordType(onload=lambda **kwargs:
+		password_options(**kwargs)))
 	first_name = db.Column(db.String(64))
 	last_name = db.Column(db.String(64))
 	title = db.Column(db.String(64), default='New Member')
@@ -50,8 +67,6 @@ class User(db.Model, UserMixin, SecurityContext):
 	timezone =  db.Column(db.String(64) , default='UTC')
 	banned = db.Column(db.Boolean(), default=False)
 	deleted = db.Column(db.Boolean(), default=False)
-	loginattempts = db.Column(db.Integer(), default=0)
-	loginlasttry = db.Column(db.DateTime, default=datetime.utcnow())
 	warning_points = db.Column(db.Integer(), default=0)
 	issixteen = db.Column(db.Boolean(), default=False)
 	avatarconfirm = db.Column(db.Boolean(), default=False)
@@ -61,18 +76,20 @@ class User(db.Model, UserMixin, SecurityContext):
 	titleconfirm = db.Column(db.Boolean(), default=False)
 	sigconfirm = db.Column(db.Boolean(), default=False)
 	hideprofile = db.Column(db.Boolean(), default=False)
-	termsagree = db.Column(db.Boolean(), default=False)
-	privacyagree = db.Column(db.Boolean(), default=False)
+	#the policy versions the user last accepted, see models/policy.py.
+	terms_version = db.Column(db.Integer(), default=0)
+	privacy_version = db.Column(db.Integer(), default=0)
 
 	email = db.relationship('Email', foreign_keys='User.email_id', post_update=True)
 	groups = db.relationship('Group', secondary=user_groups, back_populates='users')
 
 	@staticmethod
 	def has(token):
-		if db.session.query(db.exists().where(db.and_(
-			UserPermission.token==token,
-			UserPermission.user_id==current_user.id))).scalar():
-			return True
+		return token in current_tokens()
+
+	@staticmethod
+	def tokens():
+		return current_tokens()
 
 	def __repr__(self):
 		return str(self.display)
@@ -130,14 +147,11 @@ class Group(db.Model, SecurityContext):
 
 	@staticmethod
 	def has(token):
-		if db.session.query(db.exists().where(db.and_(
-				GroupPermission.token==token,
-				GroupPermission.group_id==Group.id,
-				Group.id==user_groups.c.group_id,
-				user_groups.c.user_id==current_user.id))).scalar():
-			return True
-		
-		return User.has(token)
+		return token in current_tokens()
+
+	@staticmethod
+	def tokens():
+		return current_tokens()
 
 class GroupPermission(db.Model):
 	__tablename__ = 'group_permissions'
@@ -166,6 +180,19 @@ class Warning(db.Model):
 		backref=db.backref('warnings_issued', cascade='all, delete', lazy='dynamic'),
 			foreign_keys='Warning.issuer_id')
 
+class PMBody(db.Model):
+	"""The text of private messages, stored once per distinct message.
+
+	Bodies are looked up by the sha256 of their text and count the
+	messages pointing at them, see pm_body and release_pm_bodies.
+	"""
+	__tablename__ = 'pm_bodies'
+
+	id = db.Column(db.Integer, primary_key=True)
+	hash = db.Column(db.String(64), nullable=False)
+	message = db.Column(db.Text, default='')
+	refs = db.Column(db.Integer, nullable=False, default=0)
+
 class PM(db.Model):
 	__tablename__ = 'private_messages'
 
@@ -174,9 +201,11 @@ class PM(db.Model):
 	sender_id = db.Column(db.Integer, db.ForeignKey('users.id'))
 	date = db.Column(db.DateTime, default=datetime.utcnow())
 	title = db.Column(db.String(256))
-	message = db.Column(db.Text, default='')
 	read = db.Column(db.Boolean(), default=False)
+	body_id = db.Column(db.Integer, db.ForeignKey('pm_bodies.id',
+		name='fk_private_messages_body_id'), nullable=False)
 
+	body = db.relationship('PMBody')
 	user = db.relationship('User',
 		backref=db.backref('user_pms', cascade='all, delete', lazy='dynamic'),
 		foreign_keys='PM.user_id')
@@ -184,6 +213,105 @@ class PM(db.Model):
 		backref=db.backref('sent_pms', cascade='all, delete', lazy='dynamic'),
 			foreign_keys='PM.sender_id')
 
+	@property
+	def text(self):
+		return self.body.message
+
+#permission lookups, the inbox and sent box, and warnings per user.
+db.Index('ix_user_groups_user', user_groups.c.user_id, user_groups.c.group_id)
+db.Index('ix_user_permissions_user', UserPermission.user_id, UserPermission.token)
+db.Index('ix_group_permissions_group', GroupPermission.group_id,
+	GroupPermission.token)
+db.Index('ix_private_messages_inbox', PM.user_id, PM.date, PM.id)
+db.Index('ix_private_messages_sent', PM.sender_id, PM.date, PM.id)
+db.Index('ix_warnings_user', Warning.user_id)
+db.Index('ix_warnings_date', Warning.date)
+db.Index('ix_pm_bodies_hash', PMBody.hash, unique=True)
+
+#keep the IN lists of body updates under sqlite's variable limit.
+PM_BODY_CHUNK = 500
+
+def insert_pm_body(digest, message, refs):
+	#skips the row when another request added the same text first, other
+	#databases raise the unique index's IntegrityError instead.
+	dialect = db.engine.dialect.name
+
+	if dialect == 'postgresql':
+		statement = postgresql.insert(PMBody.__table__). \
+			on_conflict_do_nothing(index_elements=['hash'])
+	elif dialect == 'sqlite':
+		statement = PMBody.__table__.insert().prefix_with('OR IGNORE')
+	elif dialect == 'mysql':
+		statement = PMBody.__table__.insert().prefix_with('IGNORE')
+	else:
+		statement = PMBody.__table__.insert()
+
+	return db.session.execute(statement.values(hash=digest, message=message,
+		refs=refs)).rowcount
+
+def pm_body(message, refs=1):
+	"""Returns the body holding message with refs more references, adding
+	it if no private message has this text yet.
+
+	A body whose references have dropped to 0 is being deleted, so it is
+	never taken again, the text gets a new body instead.
+	"""
+	digest = hashlib.sha256(message.encode('utf-8')).hexdigest()
+
+	while True:
+		body = PMBody.query.filter_by(hash=digest).first()
+
+		if body is None:
+			if insert_pm_body(digest, message, refs):
+				return PMBody.query.filter_by(hash=digest).one()
+		elif db.session.execute(PMBody.__table__.update().
+			where(db.and_(PMBody.id == body.id, PMBody.refs > 0)).
+			values(refs=PMBody.refs + refs)).rowcount:
+			return body
+		else:
+			db.session.execute(unused_pm_bodies(PMBody.id == body.id))
+			db.session.expunge(body)
+
+def release_pm_bodies(body_ids):
+	"""Drops one reference per id given, as the messages were deleted,
+	and deletes the bodies no message points at any more.
+	"""
+	db.session.flush()
+	counts = Counter(body_ids)
+
+	if not counts:
+		return
+
+	#one UPDATE per distinct number of references dropped.
+	by_count = {}
+
+	for id, count in counts.items():
+		by_count.setdefault(count, []).append(id)
+
+	for count, ids in by_count.items():
+		for i in range(0, len(ids), PM_BODY_CHUNK):
+			db.session.execute(PMBody.__table__.update().
+				where(PMBody.id.in_(ids[i:i + PM_BODY_CHUNK])).
+				values(refs=PMBody.refs - count))
+
+	ids = list(counts)
+
+	for i in range(0, len(ids), PM_BODY_CHUNK):
+		db.session.execute(unused_pm_bodies(
+			PMBody.id.in_(ids[i:i + PM_BODY_CHUNK])))
+
+def unused_pm_bodies(*filters):
+	return PMBody.__table__.delete().where(db.and_(PMBody.refs <= 0,
+		*filters))
+
+def delete_user_pms(user_id):
+	#the messages a user sent or received, along with their bodies.
+	pms = PM.query.filter(db.or_(PM.user_id == user_id,
+		PM.sender_id == user_id))
+	body_ids = [id for id, in pms.with_entities(PM.body_id)]
+	pms.delete(synchronize_session=False)
+	release_pm_bodies(body_ids)
+
 class UserOnline(object):
 	id = 0
 	display = ''
@@ -192,6 +320,169 @@ class UserOnline(object):
 		self.id = id
 		self.display = display
 
+ONLINE_USERS = 'online:users'
+ONLINE_NAMES = 'online:names'
+ONLINE_LASTACTIVE = 'online:lastactive'
+
+def epoch(date):
+	return (date - datetime(1970, 1, 1)).total_seconds()
+
+def mark_online(user):
+	#only the first request in each refresh window writes anything, and only
+	#to redis. lastactive is queued up and flushed to sql by a periodic task.
+	refresh = current_app.config.get('ONLINE_REFRESH_TIME', 60)
+
+	if not rdb.set('online:refresh:{}'.format(user.id), 1, nx=True,
+		ex=refresh):
+		return
+
+	now = epoch(datetime.utcnow())
+	pipe = rdb.pipeline()
+	pipe.zadd(ONLINE_USERS, {user.id: now})
+	pipe.hset(ONLINE_NAMES, user.id, user.display)
+	pipe.hset(ONLINE_LASTACTIVE, user.id, now)
+	pipe.execute()
+
+def online_users(limit):
+	"""Returns the most recently seen online users and the online count.
+
+	Presence lives in a sorted set scored by the time a user was last seen,
+	so both only touch the users seen within ONLINE_TIME.
+	"""
+	since = epoch(datetime.utcnow()) - current_app.config.get('ONLINE_TIME', 600)
+
+	pipe = rdb.pipeline()
+	pipe.zrevrangebyscore(ONLINE_USERS, '+inf', since, start=0, num=limit)
+	pipe.zcount(ONLINE_USERS, since, '+inf')
+	ids, count = pipe.execute()
+
+	if not ids:
+		return [], count
+
+	names = rdb.hmget(ONLINE_NAMES, ids)
+
+	return [UserOnline(id=id.decode('utf-8'), display=name.decode('utf-8'))
+		for id, name in zip(ids, names) if name is not None], count
+
+def prune_online(online_time):
+	#drop users that have not been seen within online_time from the index.
+	until = epoch(datetime.utcnow()) - online_time
+
+	ids = rdb.zrangebyscore(ONLINE_USERS, '-inf', '({}'.format(until))
+
+	if not ids:
+		return
+
+	pipe = rdb.pipeline()
+	pipe.zremrangebyscore(ONLINE_USERS, '-inf', '({}'.format(until))
+	pipe.hdel(ONLINE_NAMES, *ids)
+	pipe.execute()
+
+PERMISSIONS_VERSION = 'perms:version'
+
+def permissions_version():
+	return int(rdb.get(PERMISSIONS_VERSION) or 0)
+
+def invalidate_permissions():
+	#cached token sets carry the version they were resolved under, so bumping
+	#the version retires every cached user and group set at once. cached
+	#guest pages were rendered with the old rights and are retired too.
+	from ..pages import invalidate_pages
+
+	rdb.incr(PERMISSIONS_VERSION)
+	invalidate_pages()
+	g.pop('user_tokens', None)
+
+def cached_tokens(entry, version):
+	if entry is None:
+		return None
+
+	entry = json.loads(entry.decode('utf-8'))
+
+	if entry['version'] != version:
+		return None
+
+	return frozenset(entry['tokens'])
+
+def cache_tokens(pipe, key, version, tokens):
+	pipe.setex(key, current_app.config.get('PERMISSIONS_CACHE_TIME', 86400),
+		json.dumps({'version': version, 'tokens': sorted(tokens)}))
+
+def load_group_tokens(group_ids, version=None):
+	if version is None:
+		version = permissions_version()
+
+	if not group_ids:
+		return {}
+
+	groups = {}
+	missing = []
+	entries = rdb.mget(['perms:group:{}'.format(id) for id in group_ids])
+
+	for id, entry in zip(group_ids, entries):
+		tokens = cached_tokens(entry, version)
+
+		if tokens is None:
+			missing.append(id)
+		else:
+			groups[id] = tokens
+
+	if missing:
+		loaded = {id: set() for id in missing}
+
+		for id, token in db.session.query(GroupPermission.group_id,
+			GroupPermission.token).filter(GroupPermission.group_id.in_(missing)):
+			loaded[id].add(token)
+
+		pipe = rdb.pipeline()
+
+		for id, tokens in loaded.items():
+			cache_tokens(pipe, 'perms:group:{}'.format(id), version, tokens)
+			groups[id] = frozenset(tokens)
+
+		pipe.execute()
+
+	return groups
+
+def forget_tokens(user_id):
+	#deleted users' ids can be handed out again, drop their cached rights.
+	rdb.delete('perms:user:{}'.format(user_id))
+
+def load_tokens(user_id):
+	key = 'perms:user:{}'.format(user_id)
+	pipe = rdb.pipeline()
+	pipe.get(PERMISSIONS_VERSION)
+	pipe.get(key)
+	version, entry = pipe.execute()
+	version = int(version or 0)
+	tokens = cached_tokens(entry, version)
+
+	if tokens is not None:
+		return tokens
+
+	group_ids = [id for id, in db.session.query(user_groups.c.group_id). \
+		filter(user_groups.c.user_id==user_id)]
+	tokens = set(token for token, in db.session.query(UserPermission.token). \
+		filter(UserPermission.user_id==user_id))
+
+	for group_tokens in load_group_tokens(group_ids, version).values():
+		tokens |= group_tokens
+
+	pipe = rdb.pipeline()
+	cache_tokens(pipe, key, version, tokens)
+	pipe.execute()
+
+	return frozenset(tokens)
+
+def current_tokens():
+	#the user's tokens are resolved once and then reused for the request.
+	cached = g.get('user_tokens')
+
+	if cached is None or cached[0] != current_user.id:
+		cached = g.user_tokens = (current_user.id, load_tokens(current_user.id))
+
+	return cached[1]
+
 @login_manager.user_loader
 def load_user(user_id):
 	return User.query.get(user_id)
@@ -204,7 +495,33 @@ def on_permission_denied(*args, **kwargs):
 def user_loader():
 	return current_user
 
-login_manager.anonymous_user = lambda: User.query.filter_by(anonymous=True).first()
+guest = None
+guest_loaded = 0
+
+def load_guest():
+	"""Returns the guest user for this request.
+
+	The row is read once per GUEST_CACHE_TIME per process and merged into
+	the session without a SELECT.
+	"""
+	global guest, guest_loaded
+
+	now = time.time()
+
+	if guest is None or guest_loaded + \
+		current_app.config.get('GUEST_CACHE_TIME', 300) < now:
+		user = User.query.filter_by(anonymous=True).first()
+
+		if user is None:
+			return None
+
+		#keep a detached copy, the queried row belongs to this request.
+		db.session.expunge(user)
+		guest, guest_loaded = user, now
+
+	return db.session.merge(guest, load=False)
+
+login_manager.anonymous_user = load_guest
 login_manager.session_protection = "strong"
 login_manager.login_view = 'user.sign_in'
 login_manager.login_message_category = 'info'
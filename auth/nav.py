@@ -65,6 +65,12 @@ def get_admin_nav():
 
 	if authz.check(rights.permission(Group, 'log:view')):
 		subnav.append(('Logs', url_for('logs.view_logs')))
+
+	if authz.check(rights.permission(Group, 'mail:mass')):
+		subnav.append(('Mass Mail', url_for('admin.mass_mail')))
+
+	if authz.check(rights.permission(Group, 'pm:mass')):
+		subnav.append(('Mass PM', url_for('admin.mass_pm')))
 		
 	subnav.append(('Return To Forum', url_for('forum.view_forum')))
 
@@ -0,0 +1,71 @@
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author(s):
+#  - Andrew Wheeler <lordsatin@hotmail.com>
+#
+from functools import wraps
+from hashlib import md5
+
+from flask import current_app, request, session
+from flask_login import current_user
+
+from .models import rdb
+
+PAGES_VERSION = 'pages:version'
+
+def invalidate_pages():
+	#cached pages carry the version they were rendered under.
+	rdb.incr(PAGES_VERSION)
+
+def finish(response, etag):
+	response.set_etag(etag)
+	response.cache_control.no_cache = True
+	response.vary.add('Cookie')
+
+	return response.make_conditional(request)
+
+def guest_cached(view):
+	"""Caches the whole response of a GET for guests, keyed by URL.
+
+	Every guest sees the same page, so it is rendered once per
+	PAGE_CACHE_TIME or until invalidate_pages() is called, and
+	revalidated through its ETag.
+	"""
+	@wraps(view)
+	def wrapper(*args, **kwargs):
+		#flashed messages belong to a single visitor.
+		if request.method != 'GET' or not current_user.anonymous or \
+			'_flashes' in session:
+			return view(*args, **kwargs)
+
+		key = 'pages:{}'.format(request.full_path)
+
+		pipe = rdb.pipeline()
+		pipe.get(PAGES_VERSION)
+		pipe.hmget(key, 'version', 'etag', 'body')
+		version, (cached_version, etag, body) = pipe.execute()
+		version = version or b'0'
+
+		if cached_version == version:
+			return finish(current_app.response_class(body,
+				mimetype='text/html'), etag.decode('ascii'))
+
+		response = current_app.make_response(view(*args, **kwargs))
+
+		if response.status_code != 200 or response.direct_passthrough:
+			return response
+
+		body = response.get_data()
+		etag = md5(version + body).hexdigest()
+
+		pipe = rdb.pipeline()
+		pipe.hmset(key, {'version': version, 'etag': etag, 'body': body})
+		pipe.expire(key, current_app.config.get('PAGE_CACHE_TIME', 60))
+		pipe.execute()
+
+		return finish(response, etag)
+
+	return wrapper
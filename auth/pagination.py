@@ -0,0 +1,149 @@
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author(s):
+#  - Andrew Wheeler <lordsatin@hotmail.com>
+#
+from datetime import datetime
+from math import ceil
+import base64
+import json
+
+from flask import abort, request
+
+from .models import db
+
+CURSOR_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+def encode_cursor(values):
+	values = [value.strftime(CURSOR_TIME_FORMAT) if isinstance(value, datetime)
+		else value for value in values]
+	data = json.dumps(values, separators=(',', ':')).encode('utf-8')
+
+	return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor, keys):
+	try:
+		data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+		values = json.loads(data.decode('utf-8'))
+
+		if len(values) != len(keys):
+			abort(404)
+
+		for i, (column, descending) in enumerate(keys):
+			if column.type.python_type is datetime:
+				values[i] = datetime.strptime(values[i], CURSOR_TIME_FORMAT)
+
+		return values
+	except (ValueError, TypeError, KeyError):
+		abort(404)
+
+def seek_order(keys, forward):
+	return [column.desc() if descending == forward else column.asc()
+		for column, descending in keys]
+
+def seek_compare(column, value, greater):
+	#booleans only support equality, so spell out False < True.
+	if isinstance(value, bool):
+		if greater == value:
+			return db.false()
+
+		return column == (not value)
+
+	return column > value if greater else column < value
+
+def seek_filter(keys, values, forward):
+	clauses = []
+
+	for i, (column, descending) in enumerate(keys):
+		equal = [keys[j][0] == values[j] for j in range(i)]
+		equal.append(seek_compare(column, values[i], descending != forward))
+		clauses.append(db.and_(*equal))
+
+	return db.or_(*clauses)
+
+class SeekPagination(object):
+	def __init__(self, items, page, per_page, total, keys, has_prev, has_next):
+		self.items = items
+		self.page = page
+		self.per_page = per_page
+		self.total = total
+		self.keys = keys
+		self.has_prev = has_prev
+		self.has_next = has_next
+
+	@property
+	def pages(self):
+		return max(int(ceil(self.total / float(self.per_page))), self.page)
+
+	@property
+	def prev_num(self):
+		return self.page - 1 if self.has_prev else None
+
+	@property
+	def next_num(self):
+		return self.page + 1 if self.has_next else None
+
+	def cursor(self, item):
+		return encode_cursor([getattr(item, column.key)
+			for column, descending in self.keys])
+
+	@property
+	def prev_cursor(self):
+		return self.cursor(self.items[0]) if self.items else None
+
+	@property
+	def next_cursor(self):
+		return self.cursor(self.items[-1]) if self.items else None
+
+	def iter_pages(self, left_edge=2, left_current=2, right_current=5,
+		right_edge=2):
+		last = 0
+
+		for num in range(1, self.pages + 1):
+			if num <= left_edge or \
+				(num > self.page - left_current - 1 and \
+				num < self.page + right_current) or \
+				num > self.pages - right_edge:
+				if last + 1 != num:
+					yield None
+
+				yield num
+				last = num
+
+def seek_paginate(query, keys, page, per_page, total):
+	"""Paginates query on the ordered (column, descending) keys.
+
+	Previous and next links carry a cursor holding the key values of the
+	first or last row on the page, which is turned into a WHERE clause
+	instead of an OFFSET. Numbered links without a cursor still use an
+	OFFSET. The total is passed in from a denormalized counter so no
+	COUNT(*) is issued.
+	"""
+	after = request.args.get('after')
+	before = request.args.get('before')
+
+	if before:
+		values = decode_cursor(before, keys)
+		rows = query.filter(seek_filter(keys, values, False)). \
+			order_by(*seek_order(keys, False)).limit(per_page + 1).all()
+		items = rows[:per_page][::-1]
+		has_prev = len(rows) > per_page
+		has_next = True
+	else:
+		query = query.order_by(*seek_order(keys, True))
+
+		if after:
+			query = query.filter(seek_filter(keys, decode_cursor(after, keys), True))
+		else:
+			query = query.offset((page - 1) * per_page)
+
+		rows = query.limit(per_page + 1).all()
+		items = rows[:per_page]
+		has_prev = page > 1
+		has_next = len(rows) > per_page
+
+	return SeekPagination(items, page, per_page, total or 0, keys, has_prev,
+		has_next)
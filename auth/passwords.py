@@ -0,0 +1,138 @@
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author(s):
+#  - Andrew Wheeler <lordsatin@hotmail.com>
+#
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from contextlib import contextmanager
+from functools import lru_cache
+import os
+import threading
+
+from flask import current_app
+from passlib.context import CryptContext
+from sqlalchemy_utils.types.password import Password
+
+from .models import rdb, password_options
+
+class PasswordBusy(Exception):
+	pass
+
+pool = None
+pool_pid = None
+pool_slots = None
+pool_lock = threading.Lock()
+
+@lru_cache(maxsize=8)
+def crypt_context(options):
+	return CryptContext(**dict((name, list(value) if isinstance(value, tuple)
+		else value) for name, value in options))
+
+#these run in the pool processes.
+def create_hash(options, secret):
+	return crypt_context(options).hash(secret)
+
+def verify_hash(options, secret, hash):
+	return crypt_context(options).verify_and_update(secret, hash)
+
+def context_options():
+	return tuple(sorted((name, tuple(value) if isinstance(value, list)
+		else value) for name, value in password_options().items()))
+
+def get_pool():
+	global pool, pool_pid, pool_slots
+
+	with pool_lock:
+		#a pool does not survive a fork, each web worker starts its own.
+		if pool is None or pool_pid != os.getpid():
+			workers = current_app.config.get('PASSWORD_WORKERS', 2)
+			pool = ProcessPoolExecutor(max_workers=workers)
+			pool_pid = os.getpid()
+			pool_slots = threading.BoundedSemaphore(workers *
+				current_app.config.get('PASSWORD_QUEUE', 4))
+
+		return pool, pool_slots
+
+def run(function, *args):
+	"""Runs a hashing function in the password pool.
+
+	At most PASSWORD_QUEUE jobs per pool process wait for it, anything
+	beyond that or slower than PASSWORD_TIMEOUT raises PasswordBusy rather
+	than tying up the request thread.
+	"""
+	pool, slots = get_pool()
+	timeout = current_app.config.get('PASSWORD_TIMEOUT', 5)
+
+	if not slots.acquire(timeout=timeout):
+		raise PasswordBusy()
+
+	try:
+		return pool.submit(function, *args).result(timeout=timeout)
+	except TimeoutError:
+		raise PasswordBusy()
+	finally:
+		slots.release()
+
+def hash_password(secret):
+	return Password(run(create_hash, context_options(), secret))
+
+def verify_password(user, secret):
+	#a hash made with other settings than the configured ones is replaced,
+	#the new one is saved with the next commit.
+	if user.password is None or user.password.hash is None:
+		return False
+
+	valid, new = run(verify_hash, context_options(), secret, user.password.hash)
+
+	if valid and new:
+		user.password = Password(new)
+
+	return valid
+
+@contextmanager
+def sign_in_slot(*keys):
+	#counts the sign ins in flight per key, over the limit raises PasswordBusy.
+	limit = current_app.config.get('SIGN_IN_CONCURRENCY', 2)
+	keys = ['sign-in:busy:{}'.format(key) for key in keys]
+
+	pipe = rdb.pipeline()
+
+	for key in keys:
+		pipe.incr(key)
+		pipe.expire(key, 60)
+
+	counts = pipe.execute()[::2]
+
+	try:
+		if any(count > limit for count in counts):
+			raise PasswordBusy()
+
+		yield
+	finally:
+		pipe = rdb.pipeline()
+
+		for key in keys:
+			pipe.decr(key)
+
+		pipe.execute()
+
+def sign_in_locked(user_id):
+	return int(rdb.get('sign-in:failed:{}'.format(user_id)) or 0) >= \
+		current_app.config.get('SIGN_IN_ATTEMPTS', 5)
+
+def sign_in_failed(user_id):
+	#returns True once the account is locked out.
+	key = 'sign-in:failed:{}'.format(user_id)
+
+	pipe = rdb.pipeline()
+	pipe.incr(key)
+	pipe.expire(key, current_app.config.get('SIGN_IN_LOCK_TIME', 300))
+	failed, expire = pipe.execute()
+
+	return failed >= current_app.config.get('SIGN_IN_ATTEMPTS', 5)
+
+def sign_in_succeeded(user_id):
+	rdb.delete('sign-in:failed:{}'.format(user_id))
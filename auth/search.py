@@ -0,0 +1,56 @@
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author(s):
+#  - Andrew Wheeler <lordsatin@hotmail.com>
+#
+from flask import abort, Blueprint, render_template, request, current_app
+from flask_authz import rights
+from sqlalchemy.orm import joinedload
+
+from .forms import SearchForm
+from .models import authz, Group, User, Post, current_tokens
+from .forum import viewable_forums
+from .pagination import SeekPagination
+from .search_index import search_posts, strip_html
+
+search_view = Blueprint('search', __name__)
+
+EXCERPT_LENGTH = 300
+
+def excerpt(post):
+	text = strip_html(post.message)
+
+	if len(text) > EXCERPT_LENGTH:
+		text = text[:EXCERPT_LENGTH].rsplit(' ', 1)[0] + '…'
+
+	return text
+
+@search_view.route('/search', methods=('GET',), defaults={'page': 1})
+@search_view.route('/search/page/<int:page>', methods=('GET',))
+@authz.requires(rights.permission(Group, 'thread:view'), methods=('GET'))
+def search(page):
+	form = SearchForm(request.args)
+	results = None
+
+	if form.query.data and form.validate():
+		viewable_categories, viewable_boards = viewable_forums(current_tokens())
+		per_page = current_app.config['SEARCH_RESULTS_PER_PAGE']
+		offset = (page - 1) * per_page
+		ids = search_posts(form.query.data, viewable_boards, offset,
+			per_page + 1)
+
+		if not ids and page != 1:
+			abort(404)
+
+		posts = dict((post.id, post) for post in Post.query.
+			filter(Post.id.in_(ids[:per_page])).options(joinedload(Post.thread),
+				joinedload(Post.creator).joinedload(User.email)))
+		items = [(posts[id], excerpt(posts[id])) for id in ids[:per_page]
+			if id in posts]
+		results = SeekPagination(items, page, per_page, offset + len(ids), (),
+			page > 1, len(ids) > per_page)
+
+	return render_template('forum/search.htm', form=form, results=results)
@@ -0,0 +1,293 @@
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author(s):
+#  - Andrew Wheeler <lordsatin@hotmail.com>
+#
+from collections import Counter
+from contextlib import contextmanager
+from html.parser import HTMLParser
+import dbm
+import re
+import shelve
+
+try:
+	import fcntl
+except ImportError:
+	fcntl = None
+
+from flask import current_app
+
+from .models import db, Thread, Post
+
+SEARCH_TABLE = 'search_index'
+SEARCH_CHUNK = 500
+WORD = re.compile(r'\w+')
+
+class TextExtractor(HTMLParser):
+	def __init__(self):
+		super().__init__(convert_charrefs=True)
+		self.parts = []
+
+	def handle_data(self, data):
+		self.parts.append(data)
+
+def strip_html(message):
+	parser = TextExtractor()
+	parser.feed(message or '')
+	parser.close()
+
+	return ' '.join(' '.join(parser.parts).split())
+
+def words(text):
+	return [word.lower() for word in WORD.findall(text)]
+
+def visible_posts(post_id):
+	#the join also drops index rows left behind by bulk deletes.
+	return '''JOIN posts ON posts.id = {}
+		JOIN threads ON threads.id = posts.thread_id
+		WHERE threads.board_id IN :boards'''.format(post_id)
+
+def expanding(statement):
+	return db.text(statement).bindparams(db.bindparam('boards', expanding=True))
+
+class SqliteIndex(object):
+	"""An FTS5 table whose rowids are post ids."""
+
+	def create(self):
+		db.session.execute('CREATE VIRTUAL TABLE IF NOT EXISTS {} USING \
+			fts5(title, body)'.format(SEARCH_TABLE))
+
+	def drop(self):
+		db.session.execute('DROP TABLE IF EXISTS {}'.format(SEARCH_TABLE))
+
+	def add(self, documents):
+		self.remove([id for id, title, body in documents])
+		db.session.execute(db.text('INSERT INTO {} (rowid, title, body) \
+			VALUES (:id, :title, :body)'.format(SEARCH_TABLE)),
+			[{'id': id, 'title': title, 'body': body}
+				for id, title, body in documents])
+
+	def remove(self, ids):
+		db.session.execute(db.text('DELETE FROM {} WHERE rowid = :id'.
+			format(SEARCH_TABLE)), [{'id': id} for id in ids])
+
+	def search(self, terms, boards, offset, limit):
+		#quoting every word keeps user input out of the FTS5 query syntax.
+		query = ' '.join('"{}"'.format(term) for term in terms)
+
+		return [id for id, in db.session.execute(expanding('''
+			SELECT {table}.rowid FROM {table} {join}
+			AND {table} MATCH :query
+			ORDER BY bm25({table}, 10.0, 1.0), {table}.rowid DESC
+			LIMIT :limit OFFSET :offset'''.format(table=SEARCH_TABLE,
+				join=visible_posts(SEARCH_TABLE + '.rowid'))),
+			{'query': query, 'boards': list(boards), 'limit': limit,
+				'offset': offset})]
+
+class PostgresIndex(object):
+	"""A tsvector per post with a GIN index, titles weighted above bodies."""
+
+	def __init__(self, language):
+		self.language = language
+
+	def create(self):
+		db.session.execute('CREATE TABLE IF NOT EXISTS {} (post_id INTEGER \
+			PRIMARY KEY, document TSVECTOR NOT NULL)'.format(SEARCH_TABLE))
+		db.session.execute('CREATE INDEX IF NOT EXISTS ix_{0}_document ON {0} \
+			USING GIN (document)'.format(SEARCH_TABLE))
+
+	def drop(self):
+		db.session.execute('DROP TABLE IF EXISTS {}'.format(SEARCH_TABLE))
+
+	def add(self, documents):
+		db.session.execute(db.text('''INSERT INTO {} (post_id, document)
+			VALUES (:id, setweight(to_tsvector(CAST(:language AS regconfig),
+				:title), 'A') || to_tsvector(CAST(:language AS regconfig), :body))
+			ON CONFLICT (post_id) DO UPDATE SET document = excluded.document'''.
+			format(SEARCH_TABLE)), [{'id': id, 'title': title, 'body': body,
+				'language': self.language} for id, title, body in documents])
+
+	def remove(self, ids):
+		db.session.execute(db.text('DELETE FROM {} WHERE post_id = :id'.
+			format(SEARCH_TABLE)), [{'id': id} for id in ids])
+
+	def search(self, terms, boards, offset, limit):
+		return [id for id, in db.session.execute(expanding('''
+			SELECT {table}.post_id FROM {table} {join}
+			AND {table}.document @@ plainto_tsquery(CAST(:language AS regconfig),
+				:query)
+			ORDER BY ts_rank({table}.document, plainto_tsquery(
+				CAST(:language AS regconfig), :query)) DESC,
+				{table}.post_id DESC
+			LIMIT :limit OFFSET :offset'''.format(table=SEARCH_TABLE,
+				join=visible_posts(SEARCH_TABLE + '.post_id'))),
+			{'query': ' '.join(terms), 'language': self.language,
+				'boards': list(boards), 'limit': limit, 'offset': offset})]
+
+class FileIndex(object):
+	"""An inverted index in a shelve file for databases without full-text
+	search.
+
+	Each word maps to the posts containing it and how often, and each
+	post maps to its words so it can be taken out again. Writers hold an
+	exclusive lock on a lock file next to the index.
+	"""
+
+	def __init__(self, path):
+		self.path = path
+
+	@contextmanager
+	def open(self, flag):
+		with open(self.path + '.lock', 'a') as lock:
+			if fcntl:
+				fcntl.flock(lock, fcntl.LOCK_SH if flag == 'r' else fcntl.LOCK_EX)
+
+			with shelve.open(self.path, flag) as index:
+				yield index
+
+	def create(self):
+		with self.open('c'):
+			pass
+
+	def drop(self):
+		with self.open('n'):
+			pass
+
+	def unlink(self, index, ids, postings):
+		for id in ids:
+			for term in index.pop('d:{}'.format(id), []):
+				if term not in postings:
+					postings[term] = index.get('t:' + term, {})
+
+				postings[term].pop(id, None)
+
+	def add(self, documents):
+		with self.open('c') as index:
+			postings = {}
+			self.unlink(index, [id for id, title, body in documents], postings)
+
+			for id, title, body in documents:
+				counts = Counter(words(title) + words(body))
+
+				for term, count in counts.items():
+					if term not in postings:
+						postings[term] = index.get('t:' + term, {})
+
+					postings[term][id] = count
+
+				index['d:{}'.format(id)] = list(counts)
+
+			self.save(index, postings)
+
+	def remove(self, ids):
+		with self.open('c') as index:
+			postings = {}
+			self.unlink(index, ids, postings)
+			self.save(index, postings)
+
+	def save(self, index, postings):
+		for term, posts in postings.items():
+			if posts:
+				index['t:' + term] = posts
+			else:
+				index.pop('t:' + term, None)
+
+	def search(self, terms, boards, offset, limit):
+		try:
+			with self.open('r') as index:
+				postings = [index.get('t:' + term, {}) for term in terms]
+		except dbm.error:
+			return []
+
+		ids = set(postings[0]).intersection(*postings[1:])
+		ranked = sorted(ids, key=lambda id: (-sum(posts[id]
+			for posts in postings), -id))
+		found = []
+
+		for start in range(0, len(ranked), SEARCH_CHUNK):
+			chunk = ranked[start:start + SEARCH_CHUNK]
+			visible = set(id for id, in db.session.query(Post.id).
+				join(Thread, Post.thread_id == Thread.id).
+				filter(Post.id.in_(chunk), Thread.board_id.in_(list(boards))))
+			found.extend(id for id in chunk if id in visible)
+
+			if len(found) >= offset + limit:
+				break
+
+		return found[offset:offset + limit]
+
+def search_index():
+	"""Returns the index backend for the configured database."""
+	index = current_app.extensions.get('search_index')
+
+	if index is None:
+		dialect = db.engine.dialect.name
+
+		if dialect == 'sqlite':
+			index = SqliteIndex()
+		elif dialect == 'postgresql':
+			index = PostgresIndex(current_app.config.get('SEARCH_LANGUAGE',
+				'english'))
+		else:
+			index = FileIndex(current_app.config.get('SEARCH_INDEX_PATH',
+				'search.idx'))
+
+		current_app.extensions['search_index'] = index
+
+	return index
+
+def document(post):
+	title = post.thread.title if post.thread_post else ''
+
+	return post.id, title, strip_html(post.message)
+
+def index_posts(*posts):
+	"""Adds or replaces posts in the search index.
+
+	The session is flushed first so new posts have ids, and the database
+	backends write in the caller's transaction.
+	"""
+	db.session.flush()
+	search_index().add([document(post) for post in posts])
+
+def unindex_posts(*ids):
+	if ids:
+		search_index().remove(ids)
+
+def search_posts(query, boards, offset, limit):
+	"""Returns the ids of the best matching posts on the given boards."""
+	terms = words(query)
+
+	if not terms or not boards:
+		return []
+
+	return search_index().search(terms, boards, offset, limit)
+
+def rebuild_index():
+	"""Drops and refills the search index from every post, returns how many
+	posts were indexed.
+	"""
+	index = search_index()
+	index.drop()
+	index.create()
+	db.session.commit()
+
+	last = 0
+	total = 0
+
+	while True:
+		rows = db.session.query(Post.id, Post.thread_post, Post.message,
+			Thread.title).join(Thread, Post.thread_id == Thread.id). \
+			filter(Post.id > last).order_by(Post.id).limit(SEARCH_CHUNK).all()
+
+		if not rows:
+			return total
+
+		index.add([(id, title if thread_post else '', strip_html(message))
+			for id, thread_post, message, title in rows])
+		db.session.commit()
+		last = rows[-1][0]
+		total += len(rows)
@@ -0,0 +1,40 @@
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author(s):
+#  - Andrew Wheeler <lordsatin@hotmail.com>
+#
+from flask_sessionstore import RedisSessionInterface
+from flask_sessionstore.sessions import total_seconds
+
+SESSION_PREFIX = 'session:'
+
+class RedisSessions(RedisSessionInterface):
+	"""Stores sessions in redis with a TTL of PERMANENT_SESSION_LIFETIME.
+
+	A session that was not modified during the request is not written back,
+	only its TTL is pushed forward.
+	"""
+
+	def save_session(self, app, session, response):
+		if not session or session.modified:
+			return super(RedisSessions, self).save_session(app, session,
+				response)
+
+		self.redis.expire(self.key_prefix + session.sid,
+			total_seconds(app.permanent_session_lifetime))
+
+		if self.should_set_cookie(app, session):
+			if self.use_signer:
+				session_id = self._get_signer(app).sign(session.sid.encode())
+			else:
+				session_id = session.sid
+
+			response.set_cookie(app.session_cookie_name, session_id,
+				expires=self.get_expiration_time(app, session),
+				httponly=self.get_cookie_httponly(app),
+				domain=self.get_cookie_domain(app),
+				path=self.get_cookie_path(app),
+				secure=self.get_cookie_secure(app))
@@ -7,91 +7,288 @@
 #  - Andrew Wheeler <lordsatin@hotmail.com>
 #
 import flask
+import smtplib
 from celery import Celery
 from celery.signals import worker_process_init
 from flask import abort, Blueprint, flash, redirect
 from flask import current_app, url_for
 from flask import render_template, request
+from flask_mail import Message
 from flask_login import current_user
 from flask_authz import rights
 from .models import db, authz, Group, User, Email
 from .models import Category, Board, Thread, Post
-from .models import Warning , rdb, UserOnline, Log
+from .models import Warning , PM, PMBody, rdb, UserOnline, Log, ONLINE_LASTACTIVE
+from .models import prune_online, pm_body, release_pm_bodies, delete_user_pms
+from .models import unused_pm_bodies, forget_tokens
+from .models.user import user_groups
 from datetime import datetime, timedelta
 from .log import create_log
+from .counters import USER_COUNTERS, THREAD_COUNTERS, BOARD_COUNTERS
+from .fragments import invalidate_fragments
+from .pages import invalidate_pages
+from .search_index import unindex_posts
+from .utils import mail
 from configobj import ConfigObj
 
 config = ConfigObj('config.py')
 celery = Celery(__name__, broker=config.get('CELERY_BROKER_URL'))
 
+#keep the IN list and CASE of each flush under sqlite's variable limit.
+LASTACTIVE_FLUSH_CHUNK = 250
+#ids per counter UPDATE, each chunk is its own transaction.
+RECOUNT_CHUNK = 1000
+
+@celery.on_after_configure.connect
+def setup_periodic_tasks(sender, **kwargs):
+	sender.add_periodic_task(float(config.get('LASTACTIVE_FLUSH_TIME', 300)),
+		flush_lastactive.s(), name='flush lastactive')
+	sender.add_periodic_task(float(config.get('WARNING_SWEEP_TIME', 86400)),
+		reset_user_warnings.s(), name='reset user warnings')
+	sender.add_periodic_task(float(config.get('PM_BODY_SWEEP_TIME', 86400)),
+		prune_pm_bodies.s(), name='prune pm bodies')
+
+def mail_message(recipients, subject, template, context, base_url=None):
+	"""Describes a mail for send_async_email, which renders it.
+
+	The context is sent through the broker so it must hold plain values.
+	Links in the template are built against base_url, the host of the
+	current request by default.
+	"""
+	if base_url is None and flask.has_request_context():
+		base_url = request.host_url
+
+	return {
+		'recipients': list(recipients),
+		'subject': subject,
+		'template': template,
+		'context': context,
+		'base_url': base_url,
+	}
+
+def send_email(recipients, subject, template, **context):
+	send_async_email.delay([mail_message(recipients, subject, template,
+		context)])
+
+def render_mail(message):
+	with current_app.test_request_context(base_url=message['base_url']):
+		body = render_template(message['template'], **message['context'])
+
+	return Message(message['subject'], recipients=message['recipients'],
+		body=body)
+
+@celery.task(bind=True)
+def send_async_email(self, messages):
+	"""Renders and sends a batch of mails over one SMTP connection.
+
+	When the server cannot be reached, drops the connection or answers
+	with a temporary error the mails that were not sent yet are retried,
+	waiting twice as long each time. Mails the server rejects outright
+	are skipped.
+	"""
+	sent = 0
+
+	try:
+		with mail.connect() as connection:
+			for message in messages:
+				try:
+					connection.send(render_mail(message))
+				except smtplib.SMTPRecipientsRefused:
+					pass
+				except smtplib.SMTPResponseException as error:
+					#permanent rejections will not be accepted on a retry either.
+					if error.smtp_code < 500:
+						raise
+
+				sent += 1
+	except (smtplib.SMTPException, OSError) as error:
+		raise self.retry(exc=error, args=[messages[sent:]],
+			countdown=int(config.get('MAIL_RETRY_DELAY', 60)) *
+				2 ** self.request.retries,
+			max_retries=int(config.get('MAIL_RETRIES', 5)))
+
+@celery.task
+def send_mass_email(subject, body, base_url, group_id=None):
+	"""Mails every activated user, or the members of one group, queueing
+	the recipients in batches of MAIL_BATCH_SIZE.
+	"""
+	query = db.session.query(User.id, User.display, Email.email). \
+		join(Email, User.email_id == Email.id). \
+		filter(User.activated == True, User.anonymous == False,
+			User.deleted == False)
+
+	if group_id:
+		query = query.join(user_groups, user_groups.c.user_id == User.id). \
+			filter(user_groups.c.group_id == group_id)
+
+	batch_size = int(config.get('MAIL_BATCH_SIZE', 100))
+	last = 0
+
+	while True:
+		rows = query.filter(User.id > last).order_by(User.id). \
+			limit(batch_size).all()
+
+		if not rows:
+			return
+
+		send_async_email.delay([mail_message([email], subject, 'mail/mass.htm',
+			{'display': display, 'body': body}, base_url)
+			for id, display, email in rows])
+		last = rows[-1][0]
+
+@celery.task(bind=True)
+def send_mass_pm(self, sender_id, title, message, group_id=None,
+		display=None):
+	"""Sends a private message to every activated user, or those in one
+	group or with a display name LIKE display.
+
+	The message body is shared by all the copies. Each chunk of
+	RECOUNT_CHUNK user ids is one INSERT ... SELECT of the copies, one
+	UPDATE of the unread counts and one of the body's references,
+	committed and reported as progress.
+	"""
+	#the reference taken here keeps the body while the copies are added.
+	body = pm_body(message)
+	db.session.commit()
+
+	recipients = [User.activated == True, User.anonymous == False,
+		User.deleted == False, User.id != sender_id]
+
+	if group_id:
+		recipients.append(User.id.in_(db.select([user_groups.c.user_id]).
+			where(user_groups.c.group_id == group_id)))
+
+	if display:
+		recipients.append(User.display.like(display, escape='\\'))
+
+	date = datetime.utcnow()
+	chunks = id_ranges(User)
+	sent = 0
+
+	for done, ids in enumerate(chunks, 1):
+		chunk = db.and_(User.id.between(*ids), *recipients)
+		count = db.session.execute(PM.__table__.insert().from_select(
+			['user_id', 'sender_id', 'date', 'title', 'read', 'body_id'],
+			db.select([User.id, db.literal(sender_id), db.literal(date),
+				db.literal(title), db.literal(False),
+				db.literal(body.id)]).where(chunk))).rowcount
+		db.session.execute(User.__table__.update().where(chunk).
+			values(unreadpms=db.func.coalesce(User.unreadpms, 0) + 1))
+		db.session.execute(PMBody.__table__.update().
+			where(PMBody.id == body.id).values(refs=PMBody.refs + count))
+		db.session.commit()
+		report_progress(self, done, len(chunks))
+		sent += count
+
+	release_pm_bodies([body.id])
+	db.session.commit()
+
+	return sent
+
 @celery.task
-def send_async_email():
-	print('send async email')
+def prune_pm_bodies():
+	#bodies whose references ran out without them being deleted.
+	db.session.execute(unused_pm_bodies())
+	db.session.commit()
+
+def last_post(column, key, *joins):
+	#correlated lookup of the newest post, same order as the thread listing.
+	query = db.select([column])
+
+	for join in joins:
+		query = query.select_from(join)
+
+	return query.where(key).order_by(Post.post_time.desc(), Post.id.desc()). \
+		limit(1).as_scalar()
+
+def delete_user_posts(user_id):
+	"""Deletes a user's posts and the threads they started in bulk.
+
+	Counter decrements are computed with GROUP BY before anything is
+	deleted and applied as one UPDATE per table, then the last post of
+	every thread and board that lost posts is looked up again.
+	"""
+	own_posts = Post.creator_id == user_id
+	started = [id for id, in db.session.query(Post.thread_id).
+		filter(own_posts, Post.thread_post == True)]
+	in_started = Post.thread_id.in_(started)
+	deleted = db.or_(own_posts, in_started)
+
+	posters = db.session.query(Post.creator_id, db.func.count()). \
+		filter(in_started, Post.creator_id != user_id). \
+		group_by(Post.creator_id).all()
+	threads = db.session.query(Post.thread_id, db.func.count()). \
+		filter(own_posts, ~in_started).group_by(Post.thread_id).all()
+	boards = dict((board_id, [0, count]) for board_id, count in
+		db.session.query(Thread.board_id, db.func.count()).
+			select_from(Post).join(Thread, Post.thread_id == Thread.id).
+			filter(deleted).group_by(Thread.board_id))
+
+	for board_id, count in db.session.query(Thread.board_id,
+		db.func.count()).filter(Thread.id.in_(started)). \
+		group_by(Thread.board_id):
+		boards[board_id][0] = count
+
+	if posters:
+		db.session.execute(User.__table__.update().
+			where(User.id == db.bindparam('_id')).
+			values(postnum=User.postnum - db.bindparam('_count')),
+			[{'_id': id, '_count': count} for id, count in posters])
+
+	if threads:
+		db.session.execute(Thread.__table__.update().
+			where(Thread.id == db.bindparam('_id')).
+			values(post_count=Thread.post_count - db.bindparam('_count')),
+			[{'_id': id, '_count': count} for id, count in threads])
+
+	if boards:
+		db.session.execute(Board.__table__.update().
+			where(Board.id == db.bindparam('_id')).
+			values(threads=Board.threads - db.bindparam('_threads'),
+				post_count=Board.post_count - db.bindparam('_count')),
+			[{'_id': id, '_threads': threads_count, '_count': count}
+				for id, (threads_count, count) in boards.items()])
+
+	#drop the last post pointers first so the posts can be deleted.
+	thread_ids = [id for id, count in threads]
+	Thread.query.filter(db.or_(Thread.id.in_(started),
+		Thread.id.in_(thread_ids))). \
+		update({Thread.last_id: None}, synchronize_session=False)
+	Board.query.filter(Board.id.in_(list(boards))). \
+		update({Board.last_id: None}, synchronize_session=False)
+
+	unindex_posts(*[id for id, in db.session.query(Post.id).filter(deleted)])
+	Post.query.filter(deleted).delete(synchronize_session=False)
+	Thread.query.filter(Thread.id.in_(started)). \
+		delete(synchronize_session=False)
+
+	newest = Post.thread_id == Thread.id
+
+	Thread.query.filter(Thread.id.in_(thread_ids)).update({
+		Thread.last_id: last_post(Post.id, newest),
+		Thread.last_post: last_post(Post.post_time, newest),
+	}, synchronize_session=False)
+	Board.query.filter(Board.id.in_(list(boards))).update({
+		Board.last_id: last_post(Post.id, Thread.board_id == Board.id,
+			db.join(Post.__table__, Thread.__table__,
+				Post.thread_id == Thread.id)),
+	}, synchronize_session=False)
+
+	invalidate_fragments('thread', *thread_ids)
+	invalidate_fragments('board', *boards)
+	invalidate_pages()
 
 @celery.task
 def delete_user(user_id):
 	user = User.query.get(user_id) 
-	board_last_reset = False
-	thread_last_reset = False
 
 	if not user:
 		return
 
-	for pm in user.user_pms:
-		db.session.delete(pm)
-	
-	for pm in user.sent_pms:
-		db.session.delete(pm)
-	
-	for warning in user.user_warnings:
-		db.session.delete(warning)
-		
-	for post in user.user_posts:
-		if post.thread_post == True:
-			thread = post.thread
-			board = thread.board
-
-			for p in thread.thread_posts:
-				p.creator.postnum -= 1
-
-			thread.board.post_count -= thread.post_count
-			thread.board.threads -= 1
-			
-			if thread.board.last_post.id == thread.last.id:
-				board_last_reset = True
-					
-			db.session.delete(thread)
-			db.session.commit()
-			
-			if board_last_reset:
-				thread = Thread.query.filter_by(board_id=board.id). \
-					order_by(Thread.last_post.desc(), Thread.id.desc()).first()
-				board.last_post = thread.last
-				db.session.commit()
-				board_last_reset = False
-		else:
-			post.thread.post_count -= 1
-			post.thread.board.post_count -= 1
-			thread = post.thread
-			last_id = post.id
-
-			if post.thread.last_id == post.id:
-				thread_last_reset = True
-				
-			db.session.delete(post)
-			db.session.commit()
-
-			if thread_last_reset:
-				old_post = Post.query.filter_by(thread_id=thread.id). \
-					order_by(Post.post_time.desc(), Post.id.desc()).first()
-				thread.last_post = old_post.post_time
-				thread.last = old_post
-				
-				if thread.board.last_id == last_id:
-					thread.board.last_post = old_post
-	
-				db.session.commit()
-				thread_last_reset = False
+	delete_user_pms(user.id)
+	Warning.query.filter_by(user_id=user.id). \
+		delete(synchronize_session=False)
+	delete_user_posts(user.id)
 
 	db.session.commit()
 
@@ -126,76 +323,97 @@ def delete_user(user_id):
 	else:
 		db.session.delete(user)
 		db.session.commit()
+		forget_tokens(user_id)
 
 @celery.task
-def recount_all_users_posts():
-	users = User.query.all()
-			
-	for user in users:
-		user.postnum = 0
-		user.threadnum = 0
+def flush_lastactive():
+	#take the queued timestamps and clear them in one transaction so that
+	#requests landing mid flush are kept for the next run.
+	pipe = rdb.pipeline()
+	pipe.hgetall(ONLINE_LASTACTIVE)
+	pipe.delete(ONLINE_LASTACTIVE)
+	entries, deleted = pipe.execute()
 
-		for thread in user.user_threads:
-			user.threadnum += 1
+	lastactive = [(int(id), datetime.utcfromtimestamp(float(seconds)))
+		for id, seconds in entries.items()]
 
-		for post in user.user_posts:
-			user.postnum += 1
+	for i in range(0, len(lastactive), LASTACTIVE_FLUSH_CHUNK):
+		chunk = dict(lastactive[i:i + LASTACTIVE_FLUSH_CHUNK])
+		db.session.execute(User.__table__.update().
+			where(User.id.in_(list(chunk))).
+			values(lastactive=db.case(chunk, value=User.id)))
 
 	db.session.commit()
+	prune_online(int(config.get('ONLINE_TIME', 600)))
 
-@celery.task
-def recount_all_boards_posts():
-	boards = Board.query.all()
-			
-	for board in boards:
-		board.post_count = 0
-		board.threads = 0
-		for thread in board.board_threads:
-			thread.post_count = 0
-			board.threads += 1
-			for post in thread.thread_posts:
-				board.post_count += 1
-				thread.post_count += 1
+def id_ranges(model):
+	first, last = db.session.query(db.func.min(model.id),
+		db.func.max(model.id)).one()
 
-	db.session.commit()
+	if first is None:
+		return []
 
-@celery.task
-def reset_user_terms():
-	users = User.query.all()
+	return [(start, start + RECOUNT_CHUNK - 1)
+		for start in range(first, last + 1, RECOUNT_CHUNK)]
 
-	for user in users:
-		user.termsagree = False
+def report_progress(task, done, total):
+	if task.request.id:
+		task.update_state(state='PROGRESS',
+			meta={'current': done, 'total': total})
 
-	db.session.commit()
+def recount(task, passes):
+	"""Runs the counter UPDATEs for each (model, values) pass.
+
+	Each pass is a single UPDATE per RECOUNT_CHUNK ids whose values are
+	correlated COUNT subqueries, so nothing is loaded into the session.
+	Every chunk is committed and reported as task progress.
+	"""
+	chunks = [(model, values, ids) for model, values in passes
+		for ids in id_ranges(model)]
+
+	for done, (model, values, ids) in enumerate(chunks, 1):
+		db.session.execute(model.__table__.update().
+			where(model.id.between(*ids)).values(**values))
+		db.session.commit()
+		report_progress(task, done, len(chunks))
+
+	return len(chunks)
+
+@celery.task(bind=True)
+def recount_all_users_posts(self):
+	return recount(self, [(User, USER_COUNTERS)])
+
+@celery.task(bind=True)
+def recount_all_boards_posts(self):
+	#threads first, the board totals are counted over their posts.
+	return recount(self, [(Thread, THREAD_COUNTERS), (Board, BOARD_COUNTERS)])
 
 @celery.task
-def reset_user_privacy():	
-	users = User.query.all()
+def reset_user_warnings():
+	"""Expires warnings older than WARNING_MAX_LIFE_DAYS.
 
-	for user in users:
-		user.privacyagree = False
-	
+	The expired points are summed per user in SQL and taken off in one
+	UPDATE, which also lifts bans that drop below MAX_WARNINGS, then the
+	expired warnings are deleted in bulk.
+	"""
+	expired = Warning.date <= datetime.utcnow() - \
+		timedelta(days=int(config.get('WARNING_MAX_LIFE_DAYS', 30)))
+	max_warnings = int(config.get('MAX_WARNINGS', 20))
+	points = db.select([db.func.coalesce(db.func.sum(Warning.points), 0)]). \
+		where(db.and_(Warning.user_id == User.id, expired)).as_scalar()
+	warned = User.id.in_(db.select([Warning.user_id]).where(expired))
+	unbanned = db.and_(User.banned == True,
+		User.warning_points - points < max_warnings)
+
+	#users who asked to be deleted while banned are removed once unbanned.
+	deleted = [id for id, in db.session.query(User.id).
+		filter(warned, unbanned, User.deleted == True)]
+
+	db.session.execute(User.__table__.update().where(warned).values(
+		warning_points=User.warning_points - points,
+		banned=db.case([(unbanned, False)], else_=User.banned)))
+	Warning.query.filter(expired).delete(synchronize_session=False)
 	db.session.commit()
 
-@celery.task
-def reset_user_warnings():	
-	warnings = Warning.query.all()
-	
-	for warning in warnings:
-		if warning.date + timedelta(days= \
-			config.get('WARNING_MAX_LIFE_DAYS')) >= datetime.now():
-			warning.user.warning_points -= warning.points
-			
-			if warning.user.banned:
-				if warning.user.warning_points < \
-					config.get('MAX_WARNINGS'):
-					warning.user.banned = False
-					
-					if warning.user.deleted == True:
-						delete_user.delay(warning.user.id)
-			
-			db.session.delete(warning)
-			db.session.commit()
-
-	now = datetime.now()
-	reset_user_warnings.apply_async(eta=now + timedelta(days=7))
\ No newline at end of file
+	for id in deleted:
+		delete_user.delay(id)
\ No newline at end of file
@@ -12,33 +12,24 @@ from flask import abort, Blueprint, flash, redirect, render_template, request
 from flask import current_app, url_for, session
 from flask_login import current_user, login_user, logout_user
 from flask_authz import rights
-from flask_mail import Message
 
 import pendulum
 
 from .models import db, authz, Group, User, Email, PM, Board, Thread, Post
+from .models import policy_versions, pm_body, release_pm_bodies
 from .forms import SignUpForm, SignInForm, InvitationForm, ProfileForm, SelectForm
 from .forms import CreatePMForm, PMsForm, ViewPMForm
 from .forms import AgreementForm, ViewProfileForm, ProfileDeleteForm
-from .utils import mail, parse_token, sign_token
+from .utils import mail, parse_token, sign_token, check_password
 from .forum import check_right
 from .log import create_log
-from .tasks import send_async_email, delete_user
+from .passwords import PasswordBusy, hash_password, verify_password
+from .passwords import sign_in_slot, sign_in_locked, sign_in_failed
+from .passwords import sign_in_succeeded
+from .tasks import send_email, delete_user
 
 user_view = Blueprint('user', __name__)
 
-@user_view.route('/test', methods=('GET', 'POST'))
-def send_test():
-	form = SignUpForm()
-	msg = Message('Hello from Flask',
-							recipients=["test"])
-	msg.body = 'This is a test email sent from a background Celery task.'
-	
-	send_async_email.delay()
-	flash("""Email was sent MUWAHAHAH""", 'success')
-
-	return render_template('user/sign_up.htm', form=form)
-
 @user_view.route('/auth')
 @authz.requires(rights.authenticated(), handler=lambda: abort(401))
 def auth():
@@ -72,7 +63,7 @@ def user_agreement():
 	if form.validate_on_submit():
 		if form.accept.data:
 			if current_user.is_authenticated():
-				current_user.termsagree = 1
+				current_user.terms_version = policy_versions()['terms']
 				db.session.commit()
 				flash('You have accepted the new Terms and Conditions successfully.', 'success')
 				return redirect(url_for('forum.view_forum'))
@@ -96,7 +87,7 @@ def user_privacy():
 	if form.validate_on_submit():
 		if form.accept.data:
 			if current_user.is_authenticated():
-				current_user.privacyagree = 1
+				current_user.privacy_version = policy_versions()['privacy']
 				db.session.commit()
 				flash('You have accepted the new Privacy Policy successfully.', 'success')
 				return redirect(url_for('forum.view_forum'))
@@ -138,17 +129,23 @@ def sign_up():
 		del form.email
 
 	if form.validate_on_submit():
+		try:
+			password = hash_password(form.password.data)
+		except PasswordBusy:
+			flash('The server is busy, please try again shortly.', 'error')
+			return render_template('user/sign_up.htm', form=form)
+
 		user = User(
 				username=form.username.data.lower(),
 				display=form.display.data,
-				password=form.password.data,
+				password=password,
 				issixteen=form.issixteen.data,
 				loginconfirm=form.loginconfirm.data,
 				displayconfirm=form.displayconfirm.data,
 				regdate = datetime.utcnow(),
 				lastactive = datetime.utcnow(),
-				termsagree = True,
-				privacyagree = True,
+				terms_version = policy_versions()['terms'],
+				privacy_version = policy_versions()['privacy'],
 				activated = True,
 			)
 			
@@ -173,6 +170,7 @@ def sign_up():
 			return
 
 		user.groups.append(groups)
+		activation = None
 
 		if invitation:
 			user.email = Email(email=invitation)
@@ -185,21 +183,22 @@ def sign_up():
 			user.email = Email(email=form.email.data)
 			db.session.add(user.email)
 			user.emails.append(user.email)
-			activation=sign_token(form.email.data, tag='user:activate')
-			#mail.send_message(
-				#recipients=[form.email.data],
-				#subject='Your activation for a ascendingcreations.com account',
-				#body=render_template('mail/activate.htm',
-					#user=user,
-					#activation=activation))
+			activation=sign_token(form.email.data, tag='user:activate'). \
+				decode('ascii')
 			session['accepted'] = 0
 			session['agreed'] = 0
 		flash("""You have been signed up successfully. An e-mail has been sent 
 			to the e-mail address specified to confirm that it is yours. Please be sure to also check your Spam box.""",
 			'success')
-		print(url_for('user.activate', activation=activation, _external=True))
 		db.session.commit()
 
+		#queued once the account exists so the link never points at nothing.
+		if activation:
+			send_email([form.email.data],
+				'Your activation for a ascendingcreations.com account',
+				'mail/activate.htm', user={'display': user.display},
+				activation=activation)
+
 		return redirect(url_for('user.sign_in'))
 
 	return render_template('user/sign_up.htm', form=form)
@@ -217,27 +216,27 @@ def sign_in():
 			flash('The user credentials specified are invalid.', 'error')
 			return render_template('user/sign_in.htm', form=form)
 
-		if user.loginattempts >= 5:
-			if user.loginlasttry < datetime.utcnow():
-				user.loginattempts = 0
-				db.session.commit()
-			else:
-				flash("""You failed to login to many times,
-					Please try again later""", 'error')
-				return render_template('user/sign_in.htm', form=form)
+		if sign_in_locked(user.id):
+			flash("""You failed to login to many times,
+				Please try again later""", 'error')
+			return render_template('user/sign_in.htm', form=form)
 
-		if user.password != form.password.data:
-			user.loginattempts += 1
-			print(user.loginattempts)
+		try:
+			with sign_in_slot('ip:{}'.format(request.remote_addr),
+				'user:{}'.format(user.id)):
+				valid = verify_password(user, form.password.data)
+		except PasswordBusy:
+			flash('Too many sign in attempts at once, please try again shortly.',
+				'error')
+			return render_template('user/sign_in.htm', form=form)
 
-			if user.loginattempts >= 5:
+		if not valid:
+			if sign_in_failed(user.id):
 				flash("""You failed to login to many times,
 				Please try again later""", 'error')
-				user.loginlasttry = datetime.utcnow() + timedelta(minutes = 5)
 			else:
 				flash('The user credentials specified are invalid.', 'error')
 
-			db.session.commit()
 			return render_template('user/sign_in.htm', form=form)
 
 		if not user.is_active():
@@ -248,7 +247,7 @@ def sign_in():
 			flash('Your account has been banned.', 'error')
 			return render_template('user/sign_in.htm', form=form)
 
-		user.loginattempts = 0
+		sign_in_succeeded(user.id)
 		user.lastactive = datetime.utcnow()
 		db.session.commit()
 		
@@ -262,6 +261,8 @@ def sign_in():
 @user_view.route('/sign-out')
 def sign_out():
 	logout_user()
+	session.pop('sudo_user', None)
+	session.pop('sudo_until', None)
 
 	return redirect(url_for('user.sign_in'))
 
@@ -348,12 +349,11 @@ def invite():
 	form = InvitationForm()
 
 	if form.validate_on_submit():
-		mail.send_message(
-				recipients=[form.email.data],
-				subject='Your invitation to sign up for an account',
-				body=render_template('mail/invite.htm',
-					user=current_user,
-					invitation=sign_token(form.email.data, tag='user:invite')))
+		send_email([form.email.data],
+			'Your invitation to sign up for an account', 'mail/invite.htm',
+			user={'display': current_user.display},
+			invitation=sign_token(form.email.data, tag='user:invite').
+				decode('ascii'))
 
 		create_log('User Sent Inventations', 2)
 		flash('The invitation has been sent to {}.'.format(form.email.data),
@@ -408,7 +408,8 @@ def view_users(page):
 @user_view.route('/private_messages/<int:page>', methods=('GET', 'POST'))
 @authz.requires(rights.permission(Group, 'pm:view'), methods=('GET', 'POST'))
 def view_pms(page):
-	pm_page = PM.query.filter_by(user_id=current_user.id).paginate(page,
+	pm_page = PM.query.filter_by(user_id=current_user.id). \
+		order_by(PM.date.desc(), PM.id.desc()).paginate(page,
 		current_app.config['PMS_PER_PAGE'], False)
 
 	if not pm_page.items and page != 1:
@@ -418,7 +419,7 @@ def view_pms(page):
 	form.selected.choices = [(pm.id, '') for pm in pm_page.items]
 
 	if form.validate_on_submit():
-		if current_user.password == form.password.data:
+		if check_password(form.password.data):
 			pms = PM.query.filter(PM.id.in_(form.selected.data)).all()
 
 			for pm in pms:
@@ -427,6 +428,7 @@ def view_pms(page):
 						pm.user.unreadpms -= 1
 				db.session.delete(pm)
 
+			release_pm_bodies([pm.body_id for pm in pms])
 			db.session.commit()
 			flash('Private Messages were deleted', 'success')
 			return redirect(url_for('user.view_pms'))
@@ -444,14 +446,14 @@ def send_pm():
 	form = CreatePMForm()
 
 	if form.validate_on_submit():
-		if current_user.password == form.password.data:
+		if check_password(form.password.data):
 			user = User.query.filter(User.display==form.display.data).first()
 			
 			if user:
 				if not user.hideprofile or  check_right('admin:userview'):
 					pm  = PM (
 						title = form.title.data,
-						message = form.text.data,
+						body = pm_body(form.text.data),
 						date = datetime.utcnow()
 					)
 					
@@ -498,8 +500,9 @@ def view_pm(id):
 	
 	if form.validate_on_submit():
 		if form.delete.data:
-			if current_user.password == form.password.data:
+			if check_password(form.password.data):
 				db.session.delete(pm)
+				release_pm_bodies([pm.body_id])
 				db.session.commit()
 				flash('Private Message was Deleted', 'success')
 				return redirect(url_for('user.view_pms'))
@@ -509,7 +512,7 @@ def view_pm(id):
 		elif form.reply.data:
 			session['pmmessage'] = "Quote by {0}:<div style=\"background:#eeeeee;	border:1px \
 				solid #cccccc; padding:5px 10px\">{1}</div>".format(pm.sender.display,
-				pm.message)
+				pm.text)
 
 			if pm.title.find('RE:', 0) >= 0:
 				session['pmtitle'] = pm.title
@@ -525,7 +528,8 @@ def view_pm(id):
 @user_view.route('/sent_private_messages/<int:page>', methods=('GET', 'POST'))
 @authz.requires(rights.permission(Group, 'pm:view'), methods=('GET', 'POST'))
 def view_sent_pms(page):
-	pm_page = PM.query.filter_by(sender_id=current_user.id).paginate(page,
+	pm_page = PM.query.filter_by(sender_id=current_user.id). \
+		order_by(PM.date.desc(), PM.id.desc()).paginate(page,
 		current_app.config['PMS_PER_PAGE'], False)
 
 	if not pm_page.items and page != 1:
@@ -535,7 +539,7 @@ def view_sent_pms(page):
 	form.selected.choices = [(pm.id, '') for pm in pm_page.items]
 
 	if form.validate_on_submit():
-		if current_user.password == form.password.data:
+		if check_password(form.password.data):
 			pms = PM.query.filter(PM.id.in_(form.selected.data)).all()
 
 			for pm in pms:
@@ -543,6 +547,7 @@ def view_sent_pms(page):
 					 pm.user.unreadpms -= 1
 				db.session.delete(pm)
 
+			release_pm_bodies([pm.body_id for pm in pms])
 			db.session.commit()
 			flash('Private Messages were deleted', 'success')
 			return redirect(url_for('user.view_sent_pms'))
@@ -562,12 +567,13 @@ def view_sent_pm(id):
 
 	if form.validate_on_submit():
 		if form.delete.data:
-			if current_user.password == form.password.data:
+			if check_password(form.password.data):
 				if not pm.read:
 					if pm.user.unreadpms > 0:
 						pm.user.unreadpms -= 1
 
 				db.session.delete(pm)
+				release_pm_bodies([pm.body_id])
 				db.session.commit()
 				flash('Sent Private Message was deleted', 'success')
 				return redirect(url_for('user.view_sent_pms'))
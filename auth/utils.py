@@ -5,9 +5,11 @@
 #
 # Author(s):
 #  - S.J.R. van Schaik <stephan@synkhronix.com>
-from flask import current_app
+from flask import current_app, session
+from flask_login import current_user
 from flask_mail import Mail
 from itsdangerous import TimedJSONWebSignatureSerializer
+import time
 
 def sign_token(payload, tag=None, expires_in=None):
 	serializer = TimedJSONWebSignatureSerializer(
@@ -24,4 +26,24 @@ def parse_token(payload, tag=None):
 
 	return serializer.loads(payload)
 
+def check_password(password):
+	"""Confirms the current user's password for a protected action.
+
+	A successful check elevates the session for SUDO_MINUTES, and further
+	checks in that window pass without verifying the bcrypt hash again.
+	"""
+	now = time.time()
+
+	if session.get('sudo_user') == current_user.id and \
+		session.get('sudo_until', 0) > now:
+		return True
+
+	if current_user.password != password:
+		return False
+
+	session['sudo_user'] = current_user.id
+	session['sudo_until'] = now + current_app.config.get('SUDO_MINUTES', 15) * 60
+
+	return True
+
 mail = Mail()
@@ -14,9 +14,10 @@ from flask_login import current_user, login_user, logout_user
 from flask_authz import rights
 import pendulum
 
-from .models import db, authz, Group, User, Warning, PM
+from .models import db, authz, Group, User, Warning, PM, pm_body
 from .forms import WarningForm, EditWarningForm, CreateWarningForm
 from .log import create_log
+from .utils import check_password
 
 warnings = Blueprint('warn', __name__)
 
@@ -36,7 +37,7 @@ def admin_view_warnings(page):
 	form.selected.choices = [(warning.id, '') for warning in warn_page.items]
 
 	if form.validate_on_submit():
-		if current_user.password != form.password.data:
+		if not check_password(form.password.data):
 			flash('Password incorrect', 'error')
 			return redirect(url_for('warn.admin_view_warnings', page=page))
 
@@ -70,7 +71,7 @@ def admin_edit_warning(id):
 	warning = Warning.query.get(id) or abort(404)
 
 	if form.validate_on_submit():
-		if current_user.password == form.password.data:
+		if check_password(form.password.data):
 			warning.user.warning_points -= warning.points
 			warning.message = form.text.data
 			warning.points = form.points.data
@@ -103,7 +104,7 @@ def mod_give_warning(user_id):
 		abort(404)
 
 	if form.validate_on_submit():
-		if current_user.password == form.password.data:
+		if check_password(form.password.data):
 		
 			warning = Warning (
 				message = form.text.data,
@@ -123,7 +124,7 @@ def mod_give_warning(user_id):
 
 			pm  = PM (
 				title = 'Warning Points Recieved',
-				message = warning.message,
+				body = pm_body(warning.message),
 				date = datetime.utcnow(),
 			)
 			
@@ -8,3 +8,4 @@
 #
 from .authz import Authz, PermissionDenied, UserMixin
 from .permission import SecurityContext
+from .compiler import compile_right
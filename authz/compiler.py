@@ -0,0 +1,128 @@
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author(s):
+#  - S.J.R. van Schaik <stephan@synkhronix.com>
+#
+from string import Formatter
+
+from .rights import AnyOf, AllOf, NoneOf, Permission
+
+CONST, CALL, PERMISSION, JUMP_IF_TRUE, JUMP_IF_FALSE, NOT = range(6)
+
+def split_token(token):
+	parts = []
+
+	for literal, field, spec, conversion in Formatter().parse(token):
+		if field is None:
+			parts.append((literal, None))
+		elif spec or conversion or not field.isidentifier():
+			#leave anything fancier than {name} to str.format().
+			return None
+		else:
+			parts.append((literal, field))
+
+	if all(field is None for literal, field in parts):
+		return token
+
+	return tuple(parts)
+
+class CompiledRight(object):
+	"""A right tree flattened into a list of instructions.
+
+	Any/all/none combinators become conditional jumps over their children,
+	so evaluation is a single loop that stops as soon as the outcome is
+	known. Permission tokens are split once so that only their templated
+	parts are filled in per call, and they are tested against the token
+	set of the security context when it provides one.
+	"""
+
+	def __init__(self, right):
+		self.right = right
+		self.code = []
+		self.emit(right)
+
+	def emit(self, right):
+		if isinstance(right, AnyOf):
+			self.emit_chain(right.rights, JUMP_IF_TRUE, False)
+		elif isinstance(right, AllOf):
+			self.emit_chain(right.rights, JUMP_IF_FALSE, True)
+		elif isinstance(right, NoneOf):
+			self.emit_chain(right.rights, JUMP_IF_TRUE, False)
+			self.code.append((NOT, None))
+		elif isinstance(right, Permission):
+			token = split_token(right.token)
+
+			if token is None:
+				self.code.append((CALL, right))
+			else:
+				self.code.append((PERMISSION, (right.ctx, token)))
+		else:
+			self.code.append((CALL, right))
+
+	def emit_chain(self, rights, jump, empty):
+		if not rights:
+			self.code.append((CONST, empty))
+			return
+
+		jumps = []
+
+		for right in rights[:-1]:
+			self.emit(right)
+			jumps.append(len(self.code))
+			self.code.append((jump, None))
+
+		self.emit(rights[-1])
+
+		for pc in jumps:
+			self.code[pc] = (jump, len(self.code))
+
+	def __call__(self, authz, *args, **kwargs):
+		code = self.code
+		end = len(code)
+		contexts = {}
+		result = False
+		pc = 0
+
+		while pc < end:
+			op, arg = code[pc]
+			pc += 1
+
+			if op == PERMISSION:
+				ctx, token = arg
+
+				if not isinstance(token, str):
+					token = ''.join(literal if field is None else
+						literal + str(kwargs[field]) for literal, field in token)
+
+				if ctx not in contexts:
+					contexts[ctx] = ctx.tokens()
+
+				tokens = contexts[ctx]
+
+				if tokens is None:
+					result = bool(ctx.has(token))
+				else:
+					result = token in tokens
+			elif op == JUMP_IF_TRUE:
+				if result:
+					pc = arg
+			elif op == JUMP_IF_FALSE:
+				if not result:
+					pc = arg
+			elif op == NOT:
+				result = not result
+			elif op == CALL:
+				result = bool(arg(authz, *args, **kwargs))
+			else:
+				result = arg
+
+		return result
+
+def compile_right(right):
+	if isinstance(right, CompiledRight):
+		return right
+
+	return CompiledRight(right)
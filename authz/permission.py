@@ -10,3 +10,7 @@ class SecurityContext(object):
 	@staticmethod
 	def has(token):
 		raise NotImplemented
+
+	@staticmethod
+	def tokens():
+		return None
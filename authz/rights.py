@@ -6,41 +6,58 @@
 # Author(s):
 #  - S.J.R. van Schaik <stephan@synkhronix.com>
 #
-def any_of(*rights):
-	def func(authz, *args, **kwargs):
-		for right in rights:
+class AnyOf(object):
+	def __init__(self, rights):
+		self.rights = rights
+
+	def __call__(self, authz, *args, **kwargs):
+		for right in self.rights:
 			if right(authz, *args, **kwargs):
 				return True
 
 		return False
 
-	return func
+class AllOf(object):
+	def __init__(self, rights):
+		self.rights = rights
 
-def all_of(*rights):
-	def func(authz, *args, **kwargs):
-		for right in rights:
+	def __call__(self, authz, *args, **kwargs):
+		for right in self.rights:
 			if not right(authz, *args, **kwargs):
 				return False
 
 		return True
 
-	return func
+class NoneOf(object):
+	def __init__(self, rights):
+		self.rights = rights
 
-def none_of(*rights):
-	def func(authz, *args, **kwargs):
-		for right in rights:
+	def __call__(self, authz, *args, **kwargs):
+		for right in self.rights:
 			if right(authz, *args, **kwargs):
 				return False
 
 		return True
 
-	return func
+class Permission(object):
+	def __init__(self, ctx, token):
+		self.ctx = ctx
+		self.token = token
 
-def permission(ctx, token):
-	def func(authz, *args, **kwargs):
-		return ctx.has(token.format(**kwargs)) or False
+	def __call__(self, authz, *args, **kwargs):
+		return self.ctx.has(self.token.format(**kwargs)) or False
 
-	return func
+def any_of(*rights):
+	return AnyOf(rights)
+
+def all_of(*rights):
+	return AllOf(rights)
+
+def none_of(*rights):
+	return NoneOf(rights)
+
+def permission(ctx, token):
+	return Permission(ctx, token)
 
 def authenticated():
 	def func(authz, *args, **kwargs):
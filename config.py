@@ -21,6 +21,7 @@ GROUPS_PER_PAGE = 20
 WARNINGS_PER_PAGE = 20
 LOGS_PER_PAGE = 20
 PMS_PER_PAGE = 25
+SEARCH_RESULTS_PER_PAGE = 20
 MAX_WARNINGS = 20
 MIN_CHARS = 15
 MAX_CHARS = 8192
@@ -28,7 +29,6 @@ TITLE_MIN = 4
 TITLE_MAX = 64
 DISPLAY_MIN = 4
 DISPLAY_MAX = 256
-SESSION_TYPE = 'sqlalchemy'
 OWNER = 'genusis'
 TEMPLATES_AUTO_RELOAD = True
 CELERY_BROKER_URL='redis://localhost:6379/1',
@@ -40,3 +40,25 @@ USER_LIST_DATABASE_ID=0
 PERMANENT_SESSION_LIFETIME=7200
 REMEMBER_COOKIE_NAME='ac_remember'
 WARNING_MAX_LIFE_DAYS=30
+PERMISSIONS_CACHE_TIME=86400
+ONLINE_TIME=600
+ONLINE_REFRESH_TIME=60
+LASTACTIVE_FLUSH_TIME=300
+WARNING_SWEEP_TIME=86400
+PM_BODY_SWEEP_TIME=86400
+SUDO_MINUTES=15
+BCRYPT_ROUNDS=12
+PASSWORD_WORKERS=2
+PASSWORD_QUEUE=4
+PASSWORD_TIMEOUT=5
+SIGN_IN_CONCURRENCY=2
+SIGN_IN_ATTEMPTS=5
+SIGN_IN_LOCK_TIME=300
+FRAGMENT_CACHE_TIME=3600
+PAGE_CACHE_TIME=60
+GUEST_CACHE_TIME=300
+SEARCH_LANGUAGE='english'
+SEARCH_INDEX_PATH='search.idx'
+MAIL_BATCH_SIZE=100
+MAIL_RETRIES=5
+MAIL_RETRY_DELAY=60
\ No newline at end of file
@@ -9,7 +9,7 @@
 from functools import wraps
 
 import authz
-from authz import PermissionDenied, SecurityContext, UserMixin
+from authz import PermissionDenied, SecurityContext, UserMixin, compile_right
 from flask import current_app, request
 
 try:
@@ -29,6 +29,8 @@ class Authz(authz.Authz):
 		pass
 
 	def requires(self, right, methods=('GET'), handler=None):
+		right = compile_right(right)
+
 		def decorator(f):
 			@wraps(f)
 			def decorated_function(*args, **kwargs):
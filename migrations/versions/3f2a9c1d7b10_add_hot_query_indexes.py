@@ -0,0 +1,51 @@
+"""add indexes for the forum's hot queries
+
+Revision ID: 3f2a9c1d7b10
+Revises:
+Create Date: 2026-10-18 10:45:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f2a9c1d7b10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_threads_board_listing', 'threads',
+        ['board_id', sa.text('sticky DESC'), 'last_post', 'id'])
+    op.create_index('ix_threads_creator', 'threads', ['creator_id'])
+    op.create_index('ix_posts_thread_listing', 'posts',
+        ['thread_id', sa.text('thread_post DESC'), 'post_time', 'id'])
+    op.create_index('ix_posts_creator', 'posts', ['creator_id'])
+    op.create_index('ix_user_groups_user', 'user_groups',
+        ['user_id', 'group_id'])
+    op.create_index('ix_user_permissions_user', 'user_permissions',
+        ['user_id', 'token'])
+    op.create_index('ix_group_permissions_group', 'group_permissions',
+        ['group_id', 'token'])
+    op.create_index('ix_private_messages_inbox', 'private_messages',
+        ['user_id', 'date', 'id'])
+    op.create_index('ix_private_messages_sent', 'private_messages',
+        ['sender_id', 'date', 'id'])
+    op.create_index('ix_warnings_user', 'warnings', ['user_id'])
+    op.create_index('ix_logs_listing', 'logs', ['date', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_logs_listing', table_name='logs')
+    op.drop_index('ix_warnings_user', table_name='warnings')
+    op.drop_index('ix_private_messages_sent', table_name='private_messages')
+    op.drop_index('ix_private_messages_inbox', table_name='private_messages')
+    op.drop_index('ix_group_permissions_group', table_name='group_permissions')
+    op.drop_index('ix_user_permissions_user', table_name='user_permissions')
+    op.drop_index('ix_user_groups_user', table_name='user_groups')
+    op.drop_index('ix_posts_creator', table_name='posts')
+    op.drop_index('ix_posts_thread_listing', table_name='posts')
+    op.drop_index('ix_threads_creator', table_name='threads')
+    op.drop_index('ix_threads_board_listing', table_name='threads')
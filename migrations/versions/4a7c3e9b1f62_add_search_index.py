@@ -0,0 +1,37 @@
+"""add the full-text search index over posts and thread titles
+
+Revision ID: 4a7c3e9b1f62
+Revises: e2b8d4f61a97
+Create Date: 2026-10-18 15:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4a7c3e9b1f62'
+down_revision = 'e2b8d4f61a97'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # other databases keep the index in a file, run `rebuild-search` to fill
+    # the index after upgrading.
+    dialect = op.get_bind().dialect.name
+
+    if dialect == 'sqlite':
+        op.execute('CREATE VIRTUAL TABLE search_index USING fts5(title, body)')
+    elif dialect == 'postgresql':
+        op.execute('CREATE TABLE search_index (post_id INTEGER PRIMARY KEY, '
+            'document TSVECTOR NOT NULL)')
+        op.execute('CREATE INDEX ix_search_index_document ON search_index '
+            'USING GIN (document)')
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect in ('sqlite', 'postgresql'):
+        op.execute('DROP TABLE search_index')
@@ -0,0 +1,43 @@
+"""add shared bodies for mass private messages
+
+Revision ID: 7c1d5e3a9b48
+Revises: 4a7c3e9b1f62
+Create Date: 2026-10-18 18:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c1d5e3a9b48'
+down_revision = '4a7c3e9b1f62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('pm_bodies',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('message', sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+    with op.batch_alter_table('private_messages') as batch_op:
+        batch_op.add_column(sa.Column('body_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_private_messages_body_id',
+            'pm_bodies', ['body_id'], ['id'])
+
+
+def downgrade():
+    # copy the shared bodies back into every message before dropping them.
+    op.execute('UPDATE private_messages SET message = (SELECT message FROM '
+        'pm_bodies WHERE pm_bodies.id = private_messages.body_id) '
+        'WHERE body_id IS NOT NULL')
+
+    with op.batch_alter_table('private_messages') as batch_op:
+        batch_op.drop_constraint('fk_private_messages_body_id',
+            type_='foreignkey')
+        batch_op.drop_column('body_id')
+
+    op.drop_table('pm_bodies')
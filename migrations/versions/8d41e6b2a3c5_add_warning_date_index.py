@@ -0,0 +1,24 @@
+"""add an index for the warning expiry sweep
+
+Revision ID: 8d41e6b2a3c5
+Revises: 3f2a9c1d7b10
+Create Date: 2026-10-18 12:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d41e6b2a3c5'
+down_revision = '3f2a9c1d7b10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_warnings_date', 'warnings', ['date'])
+
+
+def downgrade():
+    op.drop_index('ix_warnings_date', table_name='warnings')
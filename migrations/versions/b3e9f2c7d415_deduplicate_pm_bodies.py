@@ -0,0 +1,112 @@
+"""move every private message's text into bodies shared by hash
+
+Revision ID: b3e9f2c7d415
+Revises: 7c1d5e3a9b48
+Create Date: 2026-10-18 20:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import hashlib
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3e9f2c7d415'
+down_revision = '7c1d5e3a9b48'
+branch_labels = None
+depends_on = None
+
+CHUNK = 500
+
+# a full Table so inserts report the new body's id.
+pm_bodies = sa.Table('pm_bodies', sa.MetaData(),
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('hash', sa.String),
+    sa.Column('message', sa.Text),
+    sa.Column('refs', sa.Integer))
+
+private_messages = sa.table('private_messages',
+    sa.column('id', sa.Integer),
+    sa.column('message', sa.Text),
+    sa.column('body_id', sa.Integer))
+
+
+def digest(message):
+    return hashlib.sha256((message or '').encode('utf-8')).hexdigest()
+
+
+def upgrade():
+    with op.batch_alter_table('pm_bodies') as batch_op:
+        batch_op.add_column(sa.Column('hash', sa.String(length=64),
+            nullable=True))
+        batch_op.add_column(sa.Column('refs', sa.Integer(), nullable=False,
+            server_default='0'))
+
+    bind = op.get_bind()
+    bodies = {}
+
+    # hash the existing mass message bodies, merging any with the same text.
+    for id, message in bind.execute(sa.select([pm_bodies.c.id,
+            pm_bodies.c.message]).order_by(pm_bodies.c.id)).fetchall():
+        key = digest(message)
+
+        if key in bodies:
+            bind.execute(private_messages.update().
+                where(private_messages.c.body_id == id).
+                values(body_id=bodies[key]))
+            bind.execute(pm_bodies.delete().where(pm_bodies.c.id == id))
+        else:
+            bind.execute(pm_bodies.update().where(pm_bodies.c.id == id).
+                values(hash=key))
+            bodies[key] = id
+
+    # then give every other message the body holding its text.
+    while True:
+        rows = bind.execute(sa.select([private_messages.c.id,
+            private_messages.c.message]).
+            where(private_messages.c.body_id == None).
+            order_by(private_messages.c.id).limit(CHUNK)).fetchall()
+
+        if not rows:
+            break
+
+        for id, message in rows:
+            key = digest(message)
+
+            if key not in bodies:
+                bodies[key] = bind.execute(pm_bodies.insert().values(
+                    hash=key, message=message or '')).inserted_primary_key[0]
+
+            bind.execute(private_messages.update().
+                where(private_messages.c.id == id).
+                values(body_id=bodies[key]))
+
+    op.execute('UPDATE pm_bodies SET refs = (SELECT count(*) FROM '
+        'private_messages WHERE private_messages.body_id = pm_bodies.id)')
+
+    with op.batch_alter_table('pm_bodies') as batch_op:
+        batch_op.alter_column('hash', existing_type=sa.String(length=64),
+            nullable=False)
+        batch_op.create_index('ix_pm_bodies_hash', ['hash'], unique=True)
+
+    with op.batch_alter_table('private_messages') as batch_op:
+        batch_op.alter_column('body_id', existing_type=sa.Integer(),
+            nullable=False)
+        batch_op.drop_column('message')
+
+
+def downgrade():
+    with op.batch_alter_table('private_messages') as batch_op:
+        batch_op.add_column(sa.Column('message', sa.Text(), nullable=True))
+        batch_op.alter_column('body_id', existing_type=sa.Integer(),
+            nullable=True)
+
+    op.execute('UPDATE private_messages SET message = (SELECT message FROM '
+        'pm_bodies WHERE pm_bodies.id = private_messages.body_id), '
+        'body_id = NULL')
+    op.execute('DELETE FROM pm_bodies')
+
+    with op.batch_alter_table('pm_bodies') as batch_op:
+        batch_op.drop_index('ix_pm_bodies_hash')
+        batch_op.drop_column('refs')
+        batch_op.drop_column('hash')
@@ -0,0 +1,60 @@
+"""replace the terms and privacy flags with policy versions
+
+Revision ID: c5e07a9f4d21
+Revises: 8d41e6b2a3c5
+Create Date: 2026-10-18 12:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5e07a9f4d21'
+down_revision = '8d41e6b2a3c5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('policies',
+        sa.Column('name', sa.String(length=32), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=True),
+        sa.Column('date', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('name')
+    )
+
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.add_column(sa.Column('terms_version', sa.Integer(),
+            nullable=True, server_default='0'))
+        batch_op.add_column(sa.Column('privacy_version', sa.Integer(),
+            nullable=True, server_default='0'))
+
+    # users that agreed so far accepted version 1 of each policy.
+    op.execute('UPDATE users SET '
+        'terms_version = CASE WHEN termsagree THEN 1 ELSE 0 END, '
+        'privacy_version = CASE WHEN privacyagree THEN 1 ELSE 0 END')
+
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('privacyagree')
+        batch_op.drop_column('termsagree')
+
+
+def downgrade():
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.add_column(sa.Column('termsagree', sa.Boolean(),
+            nullable=True))
+        batch_op.add_column(sa.Column('privacyagree', sa.Boolean(),
+            nullable=True))
+
+    op.execute("UPDATE users SET "
+        "termsagree = terms_version >= coalesce((SELECT version FROM "
+        "policies WHERE name = 'terms'), 1), "
+        "privacyagree = privacy_version >= coalesce((SELECT version FROM "
+        "policies WHERE name = 'privacy'), 1)")
+
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('privacy_version')
+        batch_op.drop_column('terms_version')
+
+    op.drop_table('policies')
@@ -0,0 +1,30 @@
+"""drop the login attempt columns, failed sign ins are counted in redis
+
+Revision ID: e2b8d4f61a97
+Revises: c5e07a9f4d21
+Create Date: 2026-10-18 14:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2b8d4f61a97'
+down_revision = 'c5e07a9f4d21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('loginlasttry')
+        batch_op.drop_column('loginattempts')
+
+
+def downgrade():
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.add_column(sa.Column('loginattempts', sa.Integer(),
+            nullable=True))
+        batch_op.add_column(sa.Column('loginlasttry', sa.DateTime(),
+            nullable=True))